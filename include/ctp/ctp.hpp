@@ -13,11 +13,19 @@
 // #define CTP_QUIET
 // If defined, don't even print version indicator.
 // #define CTP_DEAD_QUIET
+// Protocol version used to communicate with the parser. Version 1 prints one character per warning.
+// #define CTP_PROTOCOL_VERSION 2
 
 #if defined(CTP_DEAD_QUIET) && !defined(CTP_QUIET)
     #define CTP_QUIET
 #endif
 
+#if !defined(CTP_PROTOCOL_VERSION)
+    #define CTP_PROTOCOL_VERSION 2
+#elif CTP_PROTOCOL_VERSION != 1 && CTP_PROTOCOL_VERSION != 2
+    #error "Only protocol version 1 and 2 are supported."
+#endif
+
 #if defined(__clang__) || !defined(__GNUC__) || defined(__INTEL_COMPILER) || __cplusplus < 201703L
     #if !defined(CTP_QUIET)
         #define CTP_QUIET
@@ -25,6 +33,7 @@
     #endif
 #endif
 
+#include <algorithm>
 #include <array>
 #include <string_view>
 #include <tuple>
@@ -142,7 +151,19 @@ inline constexpr auto forward = detail::forward(std::forward<decltype(ExprFunc)>
 
 namespace detail {
 
-inline constexpr auto protocol_version = 1;
+inline constexpr auto protocol_version = CTP_PROTOCOL_VERSION;
+
+/// Number of characters packed into one value since protocol version 2.
+inline constexpr size_t packed_string_size = sizeof(__uint128_t);
+
+/// Bits of a packed integers value holding the count, the bit width and the sign flag since protocol version 2.
+inline constexpr size_t packed_integers_header_bits = 16;
+
+/// Bits of a packed integers value holding the integers.
+inline constexpr size_t packed_integers_payload_bits = 128 - packed_integers_header_bits;
+
+/// Minimal number of equal integers in a row sent as one run since protocol version 2.
+inline constexpr size_t run_length_min = 4;
 
 enum class Indicator : uint32_t {
 	Version = 32,
@@ -168,6 +189,9 @@ enum class Indicator : uint32_t {
 	TupleEnd = 143,
 	CustomFormatBegin = 144,
 	CustomFormatEnd = 145,
+	PackedString = 146,
+	PackedIntegers = 147,
+	RunLength = 148,
 };
 
 template<typename T, std::enable_if_t<std::is_arithmetic_v<T>>* = nullptr>
@@ -179,6 +203,34 @@ constexpr __uint128_t to_abs_int(T value) {
 	}
 }
 
+/// Integers of arrays which are packed since protocol version 2. Chars and bools are converted by their type.
+template<typename T>
+inline constexpr bool is_packable_integer_v = std::is_integral_v<T> && !std::is_same_v<T, bool> &&
+                                              !std::is_same_v<T, char> && sizeof(T) <= sizeof(uint64_t);
+
+/// Map signed integers to unsigned ones with a small magnitude (zigzag encoding): 0, -1, 1, -2 -> 0, 1, 2, 3.
+template<typename T>
+constexpr __uint128_t to_packable_int(T value) {
+	if constexpr (std::is_signed_v<T>) {
+		auto wide = static_cast<__int128_t>(value);
+		if (wide < 0) {
+			return (static_cast<__uint128_t>(-(wide + 1)) << 1) | 1;
+		}
+		return static_cast<__uint128_t>(wide) << 1;
+	} else {
+		return static_cast<__uint128_t>(value);
+	}
+}
+
+/// Number of bits needed to represent the value, at least one.
+constexpr size_t bit_width(__uint128_t value) {
+	size_t width = 1;
+	while (value >>= 1) {
+		++width;
+	}
+	return width;
+}
+
 #pragma GCC diagnostic push
 #pragma GCC diagnostic ignored "-Wshift-count-overflow"
 
@@ -239,9 +291,50 @@ template<
   typename... Args,
   std::enable_if_t<!std::is_convertible_v<T, std::string_view> && sizeof(decltype(view(std::declval<T>())))>* = nullptr>
 constexpr void print_value(int& one, T&& value, Args&&... args) {
+	using value_type = std::remove_cv_t<std::remove_reference_t<decltype(*view(value).begin())>>;
 	CTP_INTERNAL_PRINT(one, Indicator::ArrayBegin);
-	for (auto v : view(value)) {
-		print_value(one, v, std::forward<Args>(args)..., v, value);
+	if constexpr (protocol_version >= 2 && is_packable_integer_v<value_type>) {
+		// Integers are packed into as few values as possible, runs of equal integers are sent as count and integer.
+		// The values are printed right here, because the parser reads them from the frame of print_value.
+		constexpr __uint128_t is_signed = std::is_signed_v<value_type>;
+		auto values = view(value);
+		__uint128_t pack[packed_integers_payload_bits] = {};
+		size_t count = 0;
+		size_t width = 1;
+		for (auto it = values.begin(); it != values.end() || count > 0;) {
+			size_t run = 0;
+			__uint128_t v = 0;
+			if (it != values.end()) {
+				while (it + run != values.end() && it[run] == *it) {
+					++run;
+				}
+				v = to_packable_int(*it);
+			}
+			bool is_run = run >= run_length_min;
+			auto new_width = std::max(width, bit_width(v));
+			if (count > 0 && (it == values.end() || is_run || (count + 1) * new_width > packed_integers_payload_bits)) {
+				// Header: count, bit width and sign flag.
+				__uint128_t packed = count | (width << 8) | (is_signed << 15);
+				for (size_t i = 0; i < count; ++i) {
+					packed |= pack[i] << (packed_integers_header_bits + i * width);
+				}
+				CTP_INTERNAL_PRINT(packed, Indicator::PackedIntegers);
+				count = 0;
+				width = 1;
+			} else if (is_run) {
+				// Lower half: count and sign flag, upper half: the integer.
+				CTP_INTERNAL_PRINT(run | (is_signed << 63) | (v << 64), Indicator::RunLength);
+				it += run;
+			} else {
+				pack[count++] = v;
+				width = new_width;
+				++it;
+			}
+		}
+	} else {
+		for (auto v : view(value)) {
+			print_value(one, v, std::forward<Args>(args)..., v, value);
+		}
 	}
 	CTP_INTERNAL_PRINT(one, Indicator::ArrayEnd);
 }
@@ -249,9 +342,22 @@ constexpr void print_value(int& one, T&& value, Args&&... args) {
 /// Print contiguous sequence of char-like objects.
 template<typename T, typename... Args, std::enable_if_t<std::is_convertible_v<T, std::string_view>>* = nullptr>
 constexpr void print_value(int& one, T value, Args&&... args) {
-	CTP_INTERNAL_PRINT(one, Indicator::StringBegin);
-	for (auto v : std::string_view{value}) {
-		print_value(one, v, std::forward<Args>(args)..., v, value);
+	if constexpr (protocol_version >= 2) {
+		// The length tells how many characters of the last packed value belong to the string.
+		std::string_view string{value};
+		CTP_INTERNAL_PRINT(to_abs_int(string.size()), Indicator::StringBegin);
+		for (size_t i = 0; i < string.size(); i += packed_string_size) {
+			__uint128_t packed = 0;
+			for (size_t j = 0; j < packed_string_size && i + j < string.size(); ++j) {
+				packed |= static_cast<__uint128_t>(static_cast<unsigned char>(string[i + j])) << (8 * j);
+			}
+			CTP_INTERNAL_PRINT(packed, Indicator::PackedString);
+		}
+	} else {
+		CTP_INTERNAL_PRINT(one, Indicator::StringBegin);
+		for (auto v : std::string_view{value}) {
+			print_value(one, v, std::forward<Args>(args)..., v, value);
+		}
 	}
 	CTP_INTERNAL_PRINT(one, Indicator::StringEnd);
 }
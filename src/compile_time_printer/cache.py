@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple, Union
+
+from compile_time_printer.ctp import PROTOCOL_VERSION, READ_CHUNK_SIZE, CompilerStatement, PrintStatement, \
+    __version__, to_json_value
+
+# Version of the cache entry layout.
+CACHE_FORMAT_VERSION = 2
+
+# Flags which produce output files or skip preprocessing. They are removed to preprocess a compile command.
+OUTPUT_FLAGS = {'-c', '-S', '-fsyntax-only', '-MD', '-MMD'}
+OUTPUT_FLAGS_WITH_ARGUMENT = {'-o', '-MF', '-MT', '-MQ'}
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'compile-time-printer')
+
+
+def preprocess_command(command: List[str]) -> List[str]:
+    """
+    Turns a compile command into a command printing the preprocessed translation unit to stdout.
+    :param command: the compiler and its arguments
+    :return: the preprocessor command
+    """
+    arguments = []
+    skip_next = False
+    for arg in command[1:]:
+        if skip_next:
+            skip_next = False
+        elif arg in OUTPUT_FLAGS_WITH_ARGUMENT:
+            skip_next = True
+        elif arg not in OUTPUT_FLAGS and not any(arg.startswith(f) and arg != f for f in OUTPUT_FLAGS_WITH_ARGUMENT):
+            arguments.append(arg)
+    return command[:1] + ['-E'] + arguments
+
+
+def reads_stdin(command: List[str]) -> bool:
+    """
+    :param command: the compiler and its arguments
+    :return: if the source is read from stdin, which can't be read twice to preprocess and compile it
+    """
+    return '-' in preprocess_command(command)[1:]
+
+
+def writes_files(command: List[str]) -> bool:
+    """
+    :param command: the compiler and its arguments
+    :return: if the command writes files, e.g. an object file or a depfile, which are not created on a cache hit
+    """
+    arguments = command[1:]
+    if '-fsyntax-only' not in arguments:
+        # Compiles and links to a.out.
+        return True
+    return any(arg in OUTPUT_FLAGS - {'-fsyntax-only'} or arg.startswith(('-o', '-MF', '-save-temps'))
+               for arg in arguments)
+
+
+def serialize_statement(statement: Union[PrintStatement, CompilerStatement]) -> dict:
+    message, is_stderr = statement.serialize()
+    if isinstance(statement, CompilerStatement):
+        return {'kind': 'compiler', 'message': message}
+    return {'kind': 'print', 'message': message, 'stderr': is_stderr,
+            'time_point': statement._time_point, 'args': to_json_value(statement._args)}
+
+
+def deserialize_statement(entry: dict) -> Union[PrintStatement, CompilerStatement]:
+    if entry['kind'] == 'compiler':
+        return CompilerStatement(entry['message'])
+    return PrintStatement.deserialize(entry['message'], entry['stderr'], entry['time_point'], entry['args'])
+
+
+class ResultCache:
+    """
+    On-disk cache of parsed statements keyed by the preprocessed translation unit and everything else affecting the
+    output. The least recently used entries are evicted once the cache exceeds its size.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """
+        :param directory: directory of the cache entries
+        :param max_size: maximal size of all entries in bytes
+        """
+        self._directory = directory
+        self._max_size = max_size
+
+    def key(self, command: List[str], options: List) -> Optional[str]:
+        """
+        Hashes the preprocessed translation unit, the compiler and its version, the flags and the protocol version.
+        :param command: the compile command
+        :param options: further options affecting the parsed statements
+        :return: the key or None if the command can't be preprocessed
+        """
+        compiler = shutil.which(command[0])
+        if not compiler:
+            return None
+        try:
+            version = subprocess.run([compiler, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_FORMAT_VERSION, PROTOCOL_VERSION, __version__, os.path.realpath(compiler),
+                             command, options]).encode('utf8'))
+        h.update(version)
+        prog = subprocess.Popen(preprocess_command(command), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        for chunk in iter(lambda: prog.stdout.read(READ_CHUNK_SIZE), b''):
+            h.update(chunk)
+        if prog.wait() != 0:
+            return None
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + '.json')
+
+    def load(self, key: str) -> Optional[Tuple[List[Union[PrintStatement, CompilerStatement]], int]]:
+        """
+        Loads the statements and the return code of the compiler.
+        :param key: the key
+        :return: the statements and the return code or None on a cache miss
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            # Mark as recently used.
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return [deserialize_statement(s) for s in entry['statements']], entry['return_code']
+
+    def store(self, key: str, statements: List[Union[PrintStatement, CompilerStatement]], return_code: int):
+        """
+        Stores the statements and the return code of the compiler and evicts the least recently used entries.
+        :param key: the key
+        :param statements: the parsed statements
+        :param return_code: return code of the compiler
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        entry = {'statements': [serialize_statement(s) for s in statements], 'return_code': return_code}
+        # Write to a temporary file first, so concurrent runs never read a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        with os.scandir(self._directory) as it:
+            for e in it:
+                if e.name.endswith('.json'):
+                    stat = e.stat()
+                    entries.append((stat.st_mtime, stat.st_size, e.path))
+        size = sum(s for _, s, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
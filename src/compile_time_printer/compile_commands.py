@@ -0,0 +1,164 @@
+import fnmatch
+import json
+import os
+import shlex
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from compile_time_printer.ctp import COMPILER_LAUNCHERS, CTP, CompilerStatement, PrintStatement, TypePrettifier, \
+    inject_flags, print_statement, run_command
+from compile_time_printer.json_diagnostics import JsonCTP, uses_json_diagnostics
+
+# Flags needed to parse the CTP output of a translation unit without building it.
+REQUIRED_FLAGS = ['-fsyntax-only', '-fpermissive']
+
+
+class CompileCommand(NamedTuple):
+    directory: str
+    file: str
+    arguments: List[str]
+
+
+def load_compile_commands(path: str, file_filter: Optional[str] = None) -> List[CompileCommand]:
+    """
+    Loads the entries of a compilation database (compile_commands.json).
+    :param path: path to the compilation database
+    :param file_filter: glob the path of the source file has to match
+    :return: the compile commands in the order of the database
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    commands = []
+    for entry in entries:
+        directory = entry['directory']
+        file = os.path.normpath(os.path.join(directory, entry['file']))
+        if file_filter and not (fnmatch.fnmatch(file, file_filter) or fnmatch.fnmatch(entry['file'], file_filter)):
+            continue
+        arguments = entry['arguments'] if 'arguments' in entry else shlex.split(entry['command'])
+        commands.append(CompileCommand(directory, file, arguments))
+    return commands
+
+
+def add_required_flags(arguments: List[str]) -> List[str]:
+    """
+    Adds the flags required by CTP right after the compiler, so flags of the command still take precedence.
+    :param arguments: the compiler, possibly run by a compiler launcher, and its arguments
+    :return: the extended arguments
+    """
+    # Skip compiler launchers like ccache, also in front of compilers not recognized as GCC.
+    i = 0
+    while i < len(arguments) - 1 and os.path.basename(arguments[i]) in COMPILER_LAUNCHERS:
+        i += 1
+    return arguments[:i + 1] + [f for f in REQUIRED_FLAGS if f not in arguments] + arguments[i + 1:]
+
+
+def parse_command(arguments: List[str], directory: str, type_prettifier: TypePrettifier,
+                  print_compiler_log: bool) -> Tuple[List, int, Optional[str]]:
+    """
+    Runs the command and parses its compiler log with its own CTP instance.
+    :param arguments: the compiler and its arguments
+    :param directory: working directory of the command
+    :param type_prettifier: the type prettifier
+    :param print_compiler_log: flag to enable printing unparsed compiler log
+    :return: the parsed statements, the return code of the compiler and the parse error if any
+    """
+    return_code = [0]
+    log = run_command(arguments, False, return_code, cwd=directory)
+    parser_class = JsonCTP if uses_json_diagnostics(arguments) else CTP
+    ctp = parser_class(type_prettifier, print_compiler_log)
+    error = None
+    try:
+        ctp.parse_error_log(log)
+    except Exception as e:
+        error = str(e)
+        # Let the compiler finish to get its return code.
+        for _ in log:
+            pass
+    printers = ctp.printers
+    for i, printer in enumerate(printers):
+        try:
+            # Formats the messages in the worker, so invalid format strings are reported like parse errors.
+            printer.serialize()
+        except Exception as e:
+            printers = printers[:i]
+            error = error or str(e)
+            break
+    return printers, return_code[0], error
+
+
+def parse_compile_command(command: CompileCommand, type_prettifier: TypePrettifier,
+                          print_compiler_log: bool) -> Tuple[List, int, Optional[str]]:
+    """
+    Compiles one translation unit and parses its compiler log with its own CTP instance.
+    :param command: the compile command
+    :param type_prettifier: the type prettifier
+    :param print_compiler_log: flag to enable printing unparsed compiler log
+    :return: the parsed statements, the return code of the compiler and the parse error if any
+    """
+    return parse_command(add_required_flags(command.arguments), command.directory, type_prettifier,
+                         print_compiler_log)
+
+
+def run_compile_commands(commands: List[CompileCommand], type_prettifier: TypePrettifier, print_compiler_log: bool,
+                         jobs: Optional[int] = None) -> Iterator[Tuple[CompileCommand, List, int, Optional[str]]]:
+    """
+    Compiles and parses all translation units in a process pool.
+    :param commands: the compile commands
+    :param type_prettifier: the type prettifier
+    :param print_compiler_log: flag to enable printing unparsed compiler log
+    :param jobs: number of worker processes, defaults to the number of processors
+    :return: the results per translation unit in the order of the commands
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(parse_compile_command, commands, repeat(type_prettifier), repeat(print_compiler_log))
+        for command, (printers, return_code, error) in zip(commands, results):
+            yield command, printers, return_code, error
+
+
+def print_compile_commands(options) -> int:
+    """
+    Runs the compilation database given by the command line options and prints the results grouped per file.
+    :param options: the command line options
+    :return: the return code
+    """
+    commands = load_compile_commands(options.compile_commands, options.filter)
+    if not options.no_inject_flags:
+        commands = [command._replace(arguments=inject_flags(command.arguments)) for command in commands]
+    type_prettifier = TypePrettifier(options.remove, options.capture_remove, options.combine_removes)
+    deduplicator = None
+    if options.dedup:
+        from compile_time_printer.dedup import Deduplicator
+        deduplicator = Deduplicator()
+
+    return_code = 0
+    for command, printers, tu_return_code, error in run_compile_commands(commands, type_prettifier,
+                                                                         not options.hide_compiler_log,
+                                                                         options.jobs):
+        if options.format == 'text':
+            print('==> {} <=='.format(command.file), flush=True)
+        if error:
+            printers.append(CompilerStatement('{}\n'.format(error)))
+            tu_return_code = tu_return_code or 1
+        if deduplicator:
+            deduplicator.start_file(command.file)
+        for printer in printers:
+            repeated = deduplicator and isinstance(printer, PrintStatement) and \
+                deduplicator.is_repeated(printer, command.directory)
+            if repeated:
+                continue
+            # JSON records name their file instead of a header.
+            print_statement(printer, options, flush=True, file=command.file)
+        if not return_code:
+            return_code = tu_return_code
+
+    if deduplicator:
+        from compile_time_printer.dedup import print_repetitions
+        if options.format == 'jsonl':
+            for repetition in deduplicator.repetitions:
+                print(json.dumps({'message': repetition.message, 'location': repetition.location,
+                                  'files': repetition.files, 'count': len(repetition.files)}))
+        else:
+            print_repetitions(deduplicator.repetitions)
+    return return_code
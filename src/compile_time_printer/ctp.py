@@ -1,10 +1,17 @@
 import argparse
+import asyncio
 import datetime
+import io
+import json
 import math
+import os
 import pkgutil
 import re
+import signal
 import subprocess
 import sys
+import time
+from collections import OrderedDict, deque
 from enum import IntEnum
 from pathlib import Path
 
@@ -17,26 +24,98 @@ __author__ = 'Toni Neubert'
 __copyright__ = 'Copyright 2021 %s' % __author__
 __license__ = 'BSL-1.0'
 
-from typing import List, TextIO, Iterator
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, TextIO, Tuple, Iterator, Union
 
-PROTOCOL_VERSION = 1
-PROTOCOL_VERSION_INDICATOR_RE = re.compile(
-    r'In instantiation of .constexpr auto ctp::detail::print_protocol_version\(\) \[with int Version = (\d+)]')
-PROTOCOL_VERSION_ASSIGN = re.compile(r'.+?\s+int version = Version;')
-START_INDICATOR_RE = re.compile(r' in .?constexpr.? expansion of .ctp::detail::print_start_indicator<')
-END_INDICATOR_RE = re.compile(r' in .?constexpr.? expansion of .ctp::detail::print_end_indicator<')
-PRINT_INDICATOR_RE = re.compile(
+
+class PrefilteredPattern:
+    """
+    Regular expression which is only evaluated if the line contains a substring every match must contain.
+    Most lines of a compiler log are unrelated to CTP and are rejected by the cheap substring test.
+    """
+
+    def __init__(self, substring: str, pattern: str):
+        """
+        Constructor.
+        :param substring: substring every match must contain
+        :param pattern: the regular expression
+        """
+        self._substring = substring
+        self._re = re.compile(pattern)
+
+    def match(self, line: str):
+        return self._substring in line and self._re.match(line)
+
+    def search(self, line: str):
+        return self._substring in line and self._re.search(line)
+
+
+# Every line with a start or version indicator contains this.
+CTP_INDICATOR_SUBSTRING = 'ctp::detail::'
+
+PROTOCOL_VERSION = 2
+# Protocol versions of the C++ header which can be parsed.
+SUPPORTED_PROTOCOL_VERSIONS = (1, 2)
+PROTOCOL_VERSION_INDICATOR_RE = PrefilteredPattern(
+    'print_protocol_version',
+    r'constexpr auto ctp::detail::print_protocol_version\(\) \[.+ Version = (\d+)]')
+# The unused variable diagnostic following the version indicator. It may be turned into an error (e.g. by -Werror) and
+# its text may be localized, so only its location is matched. Notes like "required from here" are indented further.
+PROTOCOL_VERSION_DIAGNOSTIC_RE = re.compile(r'[^\s:][^:]*:\d+:\d+: \S')
+PROTOCOL_VERSION_NOTE_RE = re.compile(r'[^\s:][^:]*:\d+:\d+:\s{2,}\S')
+START_INDICATOR_RE = PrefilteredPattern(
+    'print_start_indicator<', r' in .?constexpr.? expansion of .ctp::detail::print_start_indicator<')
+END_INDICATOR_RE = PrefilteredPattern(
+    'print_end_indicator<', r' in .?constexpr.? expansion of .ctp::detail::print_end_indicator<')
+PRINT_INDICATOR_RE = PrefilteredPattern(
+    'print_value<',
     r'^.+in .?constexpr.? expansion of .ctp::detail::print_value<(.+?), const (ctp::detail::)?separator_t&.+$')
-VALUE_INDICATOR_RE = re.compile(r'right operand of shift expression .\((.+?) << (.+?)\).')
+# The call of ctp::print or ctp::printf is expanded right before ctp::detail::print.
+PRINT_CALL_SUBSTRING = 'ctp::detail::print<'
+CALL_SITE_RE = re.compile(r'([^\s:][^:]*:\d+:\d+):\s')
+VALUE_INDICATOR_RE = PrefilteredPattern(
+    'right operand of shift expression', r'right operand of shift expression .\((.+?) << (.+?)\).')
 
 # Matches for reducing warning outputs related to CTP.
-IN_EXPANSION_OF_CTP_MACRO_RE = re.compile(r'.+note: in expansion of macro .CTP_INTERNAL_PRINT.')
-IN_EXPANSION_OF_RE = re.compile(r'.+:\s+in.+expansion.+of.+')
-IN_TEMPLATE_ARGUMENT_FOR_TYPE = re.compile(r'.+note:\s+in template argument for type.+')
-IN_INSTANTIATION_OF_RE = re.compile(r'.+: In instantiation of.+:')
-IN_FUNCTION_RE = re.compile(r'.+: In function.+:')
-AT_GLOBAL_SCOPE_RE = re.compile(r'.+: At global scope:')
-IN_FILE_INCLUDED_RE = re.compile(r'(?:In file included|\s{16}) from .+')
+IN_EXPANSION_OF_CTP_MACRO_RE = PrefilteredPattern(
+    'CTP_INTERNAL_PRINT', r'.+note: in expansion of macro .CTP_INTERNAL_PRINT.')
+IN_EXPANSION_OF_RE = PrefilteredPattern('expansion', r'.+:\s+in.+expansion.+of.+')
+IN_TEMPLATE_ARGUMENT_FOR_TYPE = PrefilteredPattern(
+    'in template argument for type', r'.+note:\s+in template argument for type.+')
+IN_INSTANTIATION_OF_RE = PrefilteredPattern(': In instantiation of', r'.+: In instantiation of.+:')
+IN_FUNCTION_RE = PrefilteredPattern(': In function', r'.+: In function.+:')
+AT_GLOBAL_SCOPE_RE = PrefilteredPattern(': At global scope:', r'.+: At global scope:')
+IN_FILE_INCLUDED_RE = PrefilteredPattern(' from ', r'(?:In file included|\s{16}) from .+')
+
+
+def is_source_snippet(line: str) -> bool:
+    """
+    Source snippets, caret and label lines are indented, unlike diagnostics. They are missing if the compiler runs
+    with -fno-diagnostics-show-caret.
+    """
+    return line[:1] == ' ' and not IN_FILE_INCLUDED_RE.match(line)
+
+
+# Number of unparsed compiler log lines kept to find the ones related to the next print statement.
+COMPILER_LOG_WINDOW = 10000
+
+# Number of prettified types remembered by the type prettifier.
+TYPE_CACHE_SIZE = 4096
+
+# Number of bytes read at once from the compiler log.
+READ_CHUNK_SIZE = 1 << 16
+
+# Matches for splitting interleaved compiler logs per source file.
+INCLUDED_FROM_FILE_RE = re.compile(r'(?:In file included|\s{16}) from (.+?):\d+(?::\d+)?([:,])$')
+LOCATION_RE = re.compile(r'([^\s:][^:]*):(?:\d+:)*\s')
+# Compilers whose diagnostics can be reduced, e.g. g++, g++-12 or x86_64-linux-gnu-g++-12.
+GCC_RE = re.compile(r'(?:.+-)?(?:g\+\+|c\+\+|gcc)(?:-[\d.]+)?(?:\.exe)?')
+# Launchers running the compiler given as their first argument.
+COMPILER_LAUNCHERS = {'ccache', 'sccache', 'distcc'}
+# Flags dropping source snippets, caret lines and colors, which are only skipped by the parser.
+REDUCED_DIAGNOSTICS_FLAGS = ['-fno-diagnostics-show-caret', '-fno-diagnostics-color']
+# Exit code if the output has been truncated by --max-statements or --max-log-bytes.
+TRUNCATED_EXIT_CODE = 3
+SOURCE_FILE_EXTENSIONS = {'.c', '.cc', '.cp', '.cpp', '.cxx', '.c++', '.C', '.CPP', '.i', '.ii', '.cppm', '.ixx'}
 
 
 class Indicator(IntEnum):
@@ -63,6 +142,9 @@ class Indicator(IntEnum):
     TupleEnd = 143
     CustomFormatBegin = 144
     CustomFormatEnd = 145
+    PackedString = 146
+    PackedIntegers = 147
+    RunLength = 148
 
 
 class TypePrettifier:
@@ -70,317 +152,981 @@ class TypePrettifier:
     Removes unwanted type information.
     """
 
-    def __init__(self, removes: List[str], capture_removes: List[str]):
+    def __init__(self, removes: List[str], capture_removes: List[str], combine_removes: bool = False,
+                 cache_size: int = TYPE_CACHE_SIZE):
         """
         Constructor.
         :param removes: list of regex to remove from type information
         :param capture_removes: list of regex to remove from type information with one capture to keep
+        :param combine_removes: flag to remove all matches of the removes in one pass of one alternation, instead of
+                                one pass per regex
+        :param cache_size: number of prettified types to remember
         """
-        self.__removes_re = [re.compile(r) for r in removes]
+        if combine_removes and removes:
+            self.__removes_re = [re.compile('|'.join('(?:{})'.format(r) for r in removes))]
+        else:
+            self.__removes_re = [re.compile(r) for r in removes]
         self.__capture_removes = [re.compile(r) for r in capture_removes]
+        self.__cache = OrderedDict()
+        self.__cache_size = cache_size
 
     def prettify(self, line):
+        if not self.__removes_re and not self.__capture_removes:
+            return line
+
+        # The same types are printed over and over again.
+        cache = self.__cache
+        pretty_line = cache.get(line)
+        if pretty_line is not None:
+            cache.move_to_end(line)
+            return pretty_line
+
+        pretty_line = line
         for replace_re in self.__removes_re:
-            line = replace_re.sub('', line)
+            pretty_line = replace_re.sub('', pretty_line)
         for capture_replace_re in self.__capture_removes:
-            line = capture_replace_re.sub(r'\1', line)
-        return line
+            pretty_line = capture_replace_re.sub(r'\1', pretty_line)
+
+        cache[line] = pretty_line
+        if len(cache) > self.__cache_size:
+            cache.popitem(last=False)
+        return pretty_line
+
+
+class ValueStack(list):
+    """
+    Stack of the shift-reduce parser decoding the values of one print statement.
+    The bottom holds the arguments, each array, string or tuple shifts a new list on top until it is reduced.
+    """
+
+    def __init__(self):
+        super().__init__([[]])
+        # Length of the string currently decoded, strings are never nested.
+        self.string_length = 0
+
+    def decode(self, type_of_value: str, number: int, indicator: int, type_prettifier: TypePrettifier):
+        """
+        Decodes one value.
+        :param type_of_value: the type of the value
+        :param number: a representation of the value as number
+        :param indicator: the indicator code
+        :param type_prettifier: the type prettifier
+        """
+        decoder = VALUE_DECODERS.get(indicator)
+        if decoder is None:
+            raise Exception('Unexpected indicator: {}'.format(indicator))
+        decoder(self, type_of_value, number, type_prettifier)
+
+    def arguments(self) -> List:
+        """
+        :return: the decoded arguments
+        """
+        if len(self) != 1:
+            raise Exception('Incomplete print statement')
+        return self[0]
+
+
+def _decode_nan_float(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    stack[-1].append(math.nan)
+
+
+def _decode_positive_infinity_float(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    stack[-1].append(math.inf)
+
+
+def _decode_negative_infinity_float(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    stack[-1].append(-math.inf)
+
+
+def _decode_positive_float(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    # Integral part is completed by the following fraction.
+    stack.append(number)
+
+
+def _decode_negative_float(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    stack.append(-number)
+
+
+# Fractions are sent as integers with 18 decimal places.
+FRACTION_DIVISOR = math.pow(10, 18)
+
+
+def _decode_fraction_float(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    num = stack.pop()
+    factor = 1 if num >= 0 else -1
+    num += factor * float(number) / FRACTION_DIVISOR
+    stack[-1].append(num)
+
+
+# Conversions of positive integers depending on their type.
+INTEGER_CONVERSIONS = {
+    'char': chr,
+    'bool': bool,
+}
+
+
+def _decode_positive_integer(stack: ValueStack, type_of_value: str, number: int, _type_prettifier):
+    top = stack[-1]
+    if type(top) is bytearray:
+        # Character of a string.
+        top.append(number)
+        return
+    conversion = INTEGER_CONVERSIONS.get(type_of_value)
+    top.append(conversion(number) if conversion else number)
+
+
+def _decode_negative_integer(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    top = stack[-1]
+    if type(top) is bytearray:
+        # Character of a string, negative chars are the upper half of a byte (e.g. UTF-8 code units).
+        top.append(256 - number)
+        return
+    top.append(-number)
+
+
+def _decode_type(stack: ValueStack, type_of_value: str, _number, type_prettifier: TypePrettifier):
+    # The same types are printed over and over again, interning keeps a single copy of each.
+    stack[-1].append(sys.intern(type_prettifier.prettify(type_of_value)))
+
+
+def _decode_begin(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    stack.append([])
+
+
+def _decode_string_begin(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    # Characters are collected as raw bytes and decoded once at the end of the string.
+    stack.append(bytearray())
+    # Since protocol version 2 the number is the length of the string.
+    stack.string_length = number
+
+
+# Number of characters packed into one value since protocol version 2.
+PACKED_STRING_SIZE = 16
+
+
+def _decode_packed_string(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    # Characters are packed little-endian, the last value may contain less characters.
+    data = stack[-1]
+    size = min(PACKED_STRING_SIZE, stack.string_length - len(data))
+    data += number.to_bytes(PACKED_STRING_SIZE, 'little')[:size]
+
+
+# Bits of a packed integers value holding the count, the bit width and the sign flag since protocol version 2.
+PACKED_INTEGERS_HEADER_BITS = 16
+
+
+def _from_packable_int(number: int, is_signed: bool) -> int:
+    # Signed integers are zigzag encoded: 0, 1, 2, 3 -> 0, -1, 1, -2.
+    if is_signed and number & 1:
+        return -(number >> 1) - 1
+    return number >> 1 if is_signed else number
+
+
+def _decode_packed_integers(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    count = number & 0xff
+    width = (number >> 8) & 0x7f
+    is_signed = bool(number >> 15 & 1)
+    payload = number >> PACKED_INTEGERS_HEADER_BITS
+    mask = (1 << width) - 1
+    stack[-1].extend(_from_packable_int((payload >> (i * width)) & mask, is_signed) for i in range(count))
+
+
+def _decode_run_length(stack: ValueStack, _type_of_value, number: int, _type_prettifier):
+    # The lower half holds the count and the sign flag, the upper half the repeated integer.
+    count = number & ((1 << 63) - 1)
+    is_signed = bool(number >> 63 & 1)
+    stack[-1].extend([_from_packable_int(number >> 64, is_signed)] * count)
+
+
+def _decode_array_end(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    array = stack.pop()
+    stack[-1].append(array)
+
+
+def _decode_string_end(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    data = stack.pop()
+    stack[-1].append(data.decode('utf8', errors='replace'))
+
+
+def _decode_tuple_end(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    array = stack.pop()
+    stack[-1].append(tuple(array))
+
+
+def _decode_custom_format_begin(_stack, _type_of_value, _number, _type_prettifier):
+    pass
+
+
+def _decode_custom_format_end(stack: ValueStack, _type_of_value, _number, _type_prettifier):
+    # Unpack tuple, the first element is the format string. Formatted right away, so the value is a plain str.
+    format_str, *args = stack[-1].pop()
+    stack[-1].append(format_str.format(*args))
+
+
+# Decoder of each value indicator.
+VALUE_DECODERS = {
+    Indicator.NaNFloat: _decode_nan_float,
+    Indicator.PositiveInfinityFloat: _decode_positive_infinity_float,
+    Indicator.NegativeInfinityFloat: _decode_negative_infinity_float,
+    Indicator.NegativeFloat: _decode_negative_float,
+    Indicator.PositiveFloat: _decode_positive_float,
+    Indicator.FractionFloat: _decode_fraction_float,
+    Indicator.PositiveInteger: _decode_positive_integer,
+    Indicator.NegativeInteger: _decode_negative_integer,
+    Indicator.Type: _decode_type,
+    Indicator.ArrayBegin: _decode_begin,
+    Indicator.ArrayEnd: _decode_array_end,
+    Indicator.StringBegin: _decode_string_begin,
+    Indicator.StringEnd: _decode_string_end,
+    Indicator.TupleBegin: _decode_begin,
+    Indicator.TupleEnd: _decode_tuple_end,
+    Indicator.CustomFormatBegin: _decode_custom_format_begin,
+    Indicator.CustomFormatEnd: _decode_custom_format_end,
+    Indicator.PackedString: _decode_packed_string,
+    Indicator.PackedIntegers: _decode_packed_integers,
+    Indicator.RunLength: _decode_run_length,
+}
+
+
+def to_json_value(value):
+    """
+    Converts a decoded argument to a JSON value. Tuples become lists, NaN and infinity become strings.
+    """
+    if type(value) is float and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    return value
 
 
 class PrintStatement:
-    def __init__(self, time_point: datetime.timedelta, format_str: bool, output_stream: TextIO, args: List):
+    # Without a __dict__ per statement, since hundreds of thousands of them may be kept (e.g. for --timeline).
+    __slots__ = ('_time_point', '_format_str', '_output_stream', '_args', '_message', '_location')
+
+    def __init__(self, time_point: float, format_str: bool, output_stream: TextIO, args: List,
+                 location: Optional[str] = None):
+        """
+        :param time_point: seconds since the start of the compiler, when the print statement has been reached
+        :param format_str: if the first argument is a format string
+        :param output_stream: stream the message is printed to
+        :param args: the decoded arguments
+        :param location: file, line and column of the call of ctp::print or ctp::printf, if known
+        """
         self._time_point = time_point
         self._format_str = format_str
         self._output_stream = output_stream
         self._args = args
+        self._location = location
+        # Formatted on first use, statements which are never printed skip the formatting.
+        self._message = None
 
-        if self._format_str:
-            # First argument is format string.
-            self._message = self._args[0].format(*self._args[1:])
-        else:
-            self._message = ' '.join(str(x) for x in self._args) + '\n'
+    @property
+    def message(self) -> str:
+        """
+        :return: the formatted message
+        """
+        if self._message is None:
+            if self._format_str:
+                # First argument is format string.
+                self._message = self._args[0].format(*self._args[1:])
+            else:
+                self._message = ' '.join(str(x) for x in self._args) + '\n'
+        return self._message
 
     def serialize(self):
-        return self._message, self._output_stream == sys.stderr
+        return self.message, self._output_stream == sys.stderr
 
-    def print(self, time_point: bool, colored: bool):
+    def record(self) -> dict:
+        """
+        Returns the statement as JSON object.
+        """
+        return {'stream': 'stderr' if self._output_stream == sys.stderr else 'stdout', 'message': self.message,
+                'args': to_json_value(self._args), 'time_point': self._time_point,
+                'compiler_log': False}
+
+    @staticmethod
+    def deserialize(message: str, is_stderr: bool, time_point: float = 0.0, args: List = None):
+        """
+        Creates a print statement from a serialized message, e.g. of a cached result.
+        :param message: the message
+        :param is_stderr: if the message is printed to stderr
+        :param time_point: time point of the print statement in seconds
+        :param args: the arguments, if known
+        """
+        statement = PrintStatement(time_point, False, sys.stderr if is_stderr else sys.stdout, [])
+        statement._message = message
+        statement._args = args if args is not None else []
+        return statement
+
+    def __getstate__(self):
+        # Output streams can't be pickled, e.g. to pass statements between processes.
+        return (self._time_point, self._format_str, self._output_stream == sys.stderr, self._args, self._message,
+                self._location)
+
+    def __setstate__(self, state):
+        self._time_point, self._format_str, is_stderr, self._args, self._message, self._location = state
+        self._output_stream = sys.stderr if is_stderr else sys.stdout
+
+    def print(self, time_point: bool, colored: bool, flush: bool = False):
         """
         Prints all parsed arguments.
         :param time_point: if add timepoint to output
         :param colored: if output should be colored
+        :param flush: if the output stream should be flushed immediately
         """
         string = ''
         if time_point:
-            string += '{} - '.format(self._time_point)
-        string += self._message
+            # Formatted like a timedelta, e.g. 0:00:01.250000.
+            string += '{} - '.format(datetime.timedelta(seconds=self._time_point))
+        string += self.message
         if colored and self._output_stream == sys.stderr:
             string = '\033[1;31m{}\033[0m'.format(string)
 
         # Print statement.
-        print(string, end='', file=self._output_stream)
+        print(string, end='', file=self._output_stream, flush=flush)
 
 
 class CompilerStatement:
+    __slots__ = ('_message',)
+
     def __init__(self, message: str):
         self._message = message
 
     def serialize(self):
         return self._message, True
 
-    def print(self, _1, _2):
-        print(self._message, end='', file=sys.stderr)
+    def record(self) -> dict:
+        return {'stream': 'stderr', 'message': self._message, 'args': None, 'time_point': None, 'compiler_log': True}
+
+    def print(self, _1, _2, flush: bool = False):
+        print(self._message, end='', file=sys.stderr, flush=flush)
 
 
 class CTP:
-    def __init__(self, type_prettifier: TypePrettifier, print_compiler_log: bool):
+    def __init__(self, type_prettifier: TypePrettifier, print_compiler_log: bool,
+                 compiler_log_window: int = COMPILER_LOG_WINDOW, clock: Callable[[], float] = time.monotonic,
+                 start_time: Optional[float] = None):
         """
         :param print_compiler_log: flag to enable printing unparsed compiler log
+        :param compiler_log_window: number of unparsed lines kept to remove the ones related to the next print
+                                    statement, older lines are printed right away
+        :param clock: monotonic clock returning the arrival time of the current line
+        :param start_time: time of the clock the time points refer to, defaults to the time of construction
         """
         self._type_prettifier = type_prettifier
         self._printers = []
         self._print_compiler_log = print_compiler_log
-        self._compiler_log = []
+        self._compiler_log = deque()
+        self._compiler_log_window = compiler_log_window
+        self._compiler_log_front_cleaned = False
+        self._completed = []
+        self._not_available = True
+        self._clock = clock
+        self._start_time = clock() if start_time is None else start_time
+
+        # State of the print statement currently parsed.
+        self._time_diff = None
+        self._format_str = False
+        self._output_stream = None
+        self._stack = None
+        self._type_to_print = None
+        self._previous_line = ''
+        self._call_site = None
+
+        # The state is the function which parses the next line.
+        self._state = self._find_indicator
 
     @property
     def printers(self):
         self._process_compiler_log()
+        self._printers.extend(self._completed)
+        self._completed = []
         return self._printers
 
-    def parse_error_log(self, compiler_log: Iterator[str]) -> Iterator[PrintStatement]:
+    @property
+    def found_output(self) -> bool:
+        return not self._not_available
+
+    def parse_error_log(self, compiler_log: Iterator[str]):
         """
-        Parses for print statements in the compiler log.
+        Parses for print statements in the compiler log and collects them in printers.
         :param compiler_log: the compiler_log
-        :param type_prettifier: the type prettifier
-        :return: the print statements
-        """
-        not_available = True
-        start_time = datetime.datetime.now()
-
-        # For debugging only:
-        # def logger():
-        #     while True:
-        #         try:
-        #             line = next(compiler_log)
-        #             print(line)
-        #             yield line
-        #         except StopIteration:
-        #             break
-        # log = logger()
-        log = compiler_log
-
-        while True:
-            try:
-                line = next(log)
-            except StopIteration:
-                break
-
-            # Find start indicator.
-            if START_INDICATOR_RE.search(line):
-                time_diff = datetime.datetime.now() - start_time
-
-                line = next(log)
-                if 'error:' in line:
-                    raise Exception('Parsing not possible. Did you forget -fpermissive?')
-                value_match = VALUE_INDICATOR_RE.search(line)
-                if value_match:
-                    start_indicator = Indicator(int(value_match[2]))
-                else:
-                    raise Exception('No valid start indicator: {}'.format(line))
-                output_stream = sys.stdout if start_indicator in [Indicator.StartOut,
-                                                                  Indicator.StartOutFormat] else sys.stderr
-                format_str = start_indicator in [Indicator.StartOutFormat, Indicator.StartErrFormat]
-                args = self._parse_print_log(log)
-
-                self._clean_compiler_log_prefix()
-                self._printers.append(PrintStatement(time_diff, format_str, output_stream, args))
-            else:
-                version_match = PROTOCOL_VERSION_INDICATOR_RE.search(line)
-                if version_match:
-                    cpp_protocol_version = int(version_match[1])
-                    if cpp_protocol_version != PROTOCOL_VERSION:
-                        raise Exception(
-                            'Incompatible CTP versions: C++ v{} <-> Python v{}'.format(cpp_protocol_version,
-                                                                                       PROTOCOL_VERSION))
-                    not_available = False
-                    # Find: int version = Version;
-                    while not PROTOCOL_VERSION_ASSIGN.match(next(log)):
-                        pass
-                    next(log)  # ...  |     ^~~~~~~
-                else:
-                    self._compiler_log.append(line)
-        if not_available:
-            self._printers.append(CompilerStatement('No CTP output found.\n'))
+        """
+        for printer in self.stream_error_log(compiler_log):
+            self._printers.append(printer)
+
+    def stream_error_log(self, compiler_log: Iterator[str]) -> Iterator[Union[PrintStatement, CompilerStatement]]:
+        """
+        Parses for print statements in the compiler log and yields each one as soon as it is complete.
+        :param compiler_log: the compiler_log
+        :return: the print and compiler statements
+        """
+        for line in compiler_log:
+            yield from self.feed(line)
+        yield from self.finish()
+
+    async def arun(self, command: List[str], return_code: List[int] = None,
+                   cwd: str = None) -> AsyncIterator[Union[PrintStatement, CompilerStatement]]:
+        """
+        Runs the command in an asyncio subprocess and yields each statement as soon as it is complete.
+        Stdout of the command is printed if the compiler log is printed.
+        :param command: the command to run
+        :param return_code: return/status/exit code of the ran command
+        :param cwd: working directory of the command
+        :return: the print and compiler statements
+        """
+        if return_code is None:
+            return_code = [0]
+        log = arun_command(command, self._print_compiler_log, return_code, cwd)
+        try:
+            async for line in log:
+                for statement in self.feed(line):
+                    yield statement
+        finally:
+            # Kills the command if parsing failed.
+            await log.aclose()
+        for statement in self.finish():
+            yield statement
+
+    def feed(self, line: str) -> List[Union[PrintStatement, CompilerStatement]]:
+        """
+        Parses the next line of the compiler log.
+        :param line: the line
+        :return: the statements completed by this line
+        """
+        self._state(line)
+        if not self._completed:
+            return []
+        completed = self._completed
+        self._completed = []
+        return completed
+
+    def finish(self, report_missing_output: bool = True) -> List[Union[PrintStatement, CompilerStatement]]:
+        """
+        Completes parsing at the end of the compiler log.
+        :param report_missing_output: flag to add a message if no CTP output has been found
+        :return: the remaining statements
+        """
+        if self._state == self._read_start_indicator:
+            self._read_start_indicator('')
+        elif self._state == self._read_value:
+            self._complete_print_statement()
+        self._state = self._find_indicator
+
+        if self._not_available and report_missing_output:
+            self._completed.append(CompilerStatement('No CTP output found.\n'))
 
         self._clean_compiler_log_suffix()
+        completed = self._completed
+        self._completed = []
+        return completed
+
+    def _find_indicator(self, line: str):
+        # Lines without any indicator go straight to the compiler log.
+        if CTP_INDICATOR_SUBSTRING not in line:
+            self._append_compiler_log(line)
+        # Find start indicator.
+        elif START_INDICATOR_RE.search(line):
+            self._time_diff = self._clock() - self._start_time
+            self._state = self._read_start_indicator
+        else:
+            if PRINT_CALL_SUBSTRING in line:
+                call_site_match = CALL_SITE_RE.match(self._previous_line)
+                self._call_site = call_site_match[1] if call_site_match else None
+            version_match = PROTOCOL_VERSION_INDICATOR_RE.search(line)
+            if version_match:
+                cpp_protocol_version = int(version_match[1])
+                if cpp_protocol_version not in SUPPORTED_PROTOCOL_VERSIONS:
+                    raise Exception(
+                        'Incompatible CTP versions: C++ v{} <-> Python v{}'.format(cpp_protocol_version,
+                                                                                   PROTOCOL_VERSION))
+                self._not_available = False
+                self._state = self._find_version_warning
+            else:
+                self._append_compiler_log(line)
+
+    def _find_version_warning(self, line: str):
+        # Find: warning: unused variable 'version'
+        if PROTOCOL_VERSION_DIAGNOSTIC_RE.match(line):
+            self._state = self._skip_source_snippet
+        elif CTP_INDICATOR_SUBSTRING in line or not PROTOCOL_VERSION_NOTE_RE.match(line):
+            # The diagnostic is missing, e.g. suppressed by the build, so the line belongs to something else.
+            self._state = self._find_indicator
+            self._find_indicator(line)
+
+    def _read_start_indicator(self, line: str):
+        if 'error:' in line:
+            raise Exception('Parsing not possible. Did you forget -fpermissive?')
+        value_match = VALUE_INDICATOR_RE.search(line)
+        if value_match:
+            start_indicator = Indicator(int(value_match[2]))
+        else:
+            raise Exception('No valid start indicator: {}'.format(line))
+        self._output_stream = sys.stdout if start_indicator in [Indicator.StartOut,
+                                                                Indicator.StartOutFormat] else sys.stderr
+        self._format_str = start_indicator in [Indicator.StartOutFormat, Indicator.StartErrFormat]
+        self._stack = ValueStack()
+        self._type_to_print = None
+        self._state = self._read_value
+
+    def _read_value(self, line: str):
+        """
+        Parses for the parameters in the print log.
+        :param line: the line of the print log
+        """
+        # Find a print indicator followed by a value indicator.
+        if self._type_to_print:
+            value_match = VALUE_INDICATOR_RE.search(line)
+            if value_match:
+                # GCC prints values exceeding 64 bits in hexadecimal.
+                self._stack.decode(self._type_to_print, int(value_match[1], 0), int(value_match[2]),
+                                   self._type_prettifier)
+                self._type_to_print = None
+                return
+        print_value_match = PRINT_INDICATOR_RE.match(line)
+        if print_value_match:
+            self._type_to_print = print_value_match[1]
+        elif self._type_to_print:
+            # Neither value indicator nor print indicator after a print indicator is an error.
+            raise Exception('No valid print statement: {}'.format(line))
+        elif END_INDICATOR_RE.search(line):
+            self._complete_print_statement()
+            self._state = self._skip_ctp_output
+
+    def _complete_print_statement(self):
+        args = self._stack.arguments()
+
+        self._clean_compiler_log_prefix()
+        self._completed.append(PrintStatement(self._time_diff, self._format_str, self._output_stream, args,
+                                              self._call_site))
+
+    def _skip_ctp_output(self, line: str):
+        """
+        Skips until the end of a fpermissive warning.
+        :param line: the line of the print log
+        """
+        if IN_EXPANSION_OF_CTP_MACRO_RE.match(line):
+            self._state = self._skip_source_snippet
+
+    def _skip_source_snippet(self, line: str):
+        """
+        Skips the source snippet of a CTP warning, if any.
+        :param line: the line of the print log
+        """
+        if not is_source_snippet(line):
+            self._state = self._find_indicator
+            self._find_indicator(line)
+
+    def _append_compiler_log(self, line: str):
+        # Might be the call site of the next print statement.
+        self._previous_line = line
+        if not self._print_compiler_log:
+            # Nothing of the compiler log would be printed.
+            return
+        compiler_log = self._compiler_log
+        compiler_log.append(line)
+        if len(compiler_log) > self._compiler_log_window:
+            # Lines leaving the window are not related to the next print statement anymore.
+            if not self._compiler_log_front_cleaned:
+                self._clean_compiler_log_front()
+                self._compiler_log_front_cleaned = True
+            if compiler_log:
+                self._completed.append(CompilerStatement(compiler_log.popleft()))
 
     def _process_compiler_log(self):
+        compiler_log = self._compiler_log
         if self._print_compiler_log:
-            for cl in self._compiler_log:
-                self._printers.append(CompilerStatement(cl))
-        self._compiler_log = []
+            for cl in compiler_log:
+                self._completed.append(CompilerStatement(cl))
+        compiler_log.clear()
+        self._compiler_log_front_cleaned = False
+
+    def _clean_compiler_log_front(self):
+        # Remove all in template arguments for type warnings.
+        compiler_log = self._compiler_log
+        while compiler_log and IN_TEMPLATE_ARGUMENT_FOR_TYPE.match(compiler_log[0]):
+            compiler_log.popleft()
+            while compiler_log and is_source_snippet(compiler_log[0]):
+                compiler_log.popleft()
 
     def _clean_compiler_log_prefix(self):
+        compiler_log = self._compiler_log
+
         # Remove all in expansion related warnings.
-        while len(self._compiler_log) > 0 and IN_EXPANSION_OF_RE.match(self._compiler_log[-1]):
-            self._compiler_log.pop()
+        while compiler_log and IN_EXPANSION_OF_RE.match(compiler_log[-1]):
+            compiler_log.pop()
 
         # Remove all in instantiation related warnings.
-        if len(self._compiler_log) > 0 and (
-                AT_GLOBAL_SCOPE_RE.match(
-                    self._compiler_log[-1]) or IN_FUNCTION_RE.match(self._compiler_log[-1])):
-            self._compiler_log.pop()
+        if compiler_log and (AT_GLOBAL_SCOPE_RE.match(compiler_log[-1]) or IN_FUNCTION_RE.match(compiler_log[-1])):
+            compiler_log.pop()
         else:
-            while len(self._compiler_log) > 0:
-                if IN_INSTANTIATION_OF_RE.match(self._compiler_log[-1]):
-                    self._compiler_log.pop()
+            while compiler_log:
+                if IN_INSTANTIATION_OF_RE.match(compiler_log[-1]):
+                    compiler_log.pop()
                     break
-                self._compiler_log.pop()
+                compiler_log.pop()
 
         # Remove in file included from.
-        while len(self._compiler_log) > 0 and IN_FILE_INCLUDED_RE.match(self._compiler_log[-1]):
-            self._compiler_log.pop()
+        while compiler_log and IN_FILE_INCLUDED_RE.match(compiler_log[-1]):
+            compiler_log.pop()
 
-        # Remove all in template arguments for type warnings.
-        while len(self._compiler_log) > 0 and IN_TEMPLATE_ARGUMENT_FOR_TYPE.match(self._compiler_log[0]):
-            self._compiler_log.pop(0)
-            self._compiler_log.pop(0)
-            self._compiler_log.pop(0)
+        if not self._compiler_log_front_cleaned:
+            self._clean_compiler_log_front()
 
         self._process_compiler_log()
 
     def _clean_compiler_log_suffix(self):
-        # Remove all in template arguments for type warnings.
-        while len(self._compiler_log) > 0 and IN_TEMPLATE_ARGUMENT_FOR_TYPE.match(self._compiler_log[0]):
-            self._compiler_log.pop(0)
-            self._compiler_log.pop(0)
-            self._compiler_log.pop(0)
+        compiler_log = self._compiler_log
+
+        if not self._compiler_log_front_cleaned:
+            self._clean_compiler_log_front()
 
         # Remove in file included from.
-        while len(self._compiler_log) > 0 and IN_FILE_INCLUDED_RE.match(self._compiler_log[-1]):
-            self._compiler_log.pop()
+        while compiler_log and IN_FILE_INCLUDED_RE.match(compiler_log[-1]):
+            compiler_log.pop()
 
         self._process_compiler_log()
 
-    def _parse_print_log(self, log: Iterator[str]):
+
+class Demultiplexer:
+    """
+    Splits the interleaved compiler log of parallel builds (e.g. make -j) into one log per source file using the
+    file prefixes of the diagnostics. Each log is parsed by its own CTP instance.
+    Lines without a source file prefix (e.g. locations in headers or source snippets) belong to the source file of the
+    previous line.
+    """
+
+    def __init__(self, create_ctp: Callable[[], CTP]):
         """
-        Parses for the parameters in the print log.
-        :param log: the print log
-        :param type_prettifier: Prettifier for types
-        """
-        stack: List = [[]]
-
-        def parse_value(type_of_value: str, number: int, indicator: Indicator):
-            """
-            Logic of a shift-reduce parser.
-            :param type_of_value: the type of the value
-            :param number: a representation of the value as number
-            :param indicator: the indicator
-            :return:
-            """
-            if indicator == Indicator.NaNFloat:
-                stack[-1].append(math.nan)
-            elif indicator == Indicator.PositiveInfinityFloat:
-                stack[-1].append(math.inf)
-            elif indicator == Indicator.NegativeInfinityFloat:
-                stack[-1].append(-math.inf)
-            elif indicator == Indicator.PositiveFloat:
-                stack.append(number)
-            elif indicator == Indicator.NegativeFloat:
-                stack.append(-number)
-            elif indicator == Indicator.FractionFloat:
-                num = stack.pop()
-                factor = 1 if num >= 0 else -1
-                num += factor * float(number) / math.pow(10, 18)
-                stack[-1].append(num)
-            elif indicator == Indicator.PositiveInteger:
-                if type_of_value == 'char':
-                    stack[-1].append(chr(number))
-                elif type_of_value == 'bool':
-                    stack[-1].append(bool(number))
-                else:
-                    stack[-1].append(number)
-            elif indicator == Indicator.NegativeInteger:
-                stack[-1].append(-number)
-            elif indicator == Indicator.Type:
-                stack[-1].append(self._type_prettifier.prettify(type_of_value))
-            elif indicator in [Indicator.ArrayBegin, Indicator.StringBegin, indicator.TupleBegin]:
-                stack.append([])
-            elif indicator == Indicator.ArrayEnd:
-                array = stack.pop()
-                stack[-1].append(array)
-            elif indicator == Indicator.StringEnd:
-                array = stack.pop()
-                stack[-1].append(''.join(array))
-            elif indicator == Indicator.TupleEnd:
-                array = stack.pop()
-                stack[-1].append(tuple(array))
-            elif indicator == Indicator.CustomFormatBegin:
-                pass
-            elif indicator == Indicator.CustomFormatEnd:
-                # Unpack tuple.
-                array = [*stack[-1].pop()]
-                # First element is format string.
-                stack[-1].append(array[0].format(*array[1:]))
-            else:
-                raise Exception('Unexpected indicator: {}'.format(int(indicator)))
-
-        type_to_print = None
-        for line in log:
-            # Find a print indicator followed by a value indicator.
-            if type_to_print:
-                value_match = VALUE_INDICATOR_RE.search(line)
-                if value_match:
-                    parse_value(type_to_print, int(value_match[1]), Indicator(int(value_match[2])))
-                    type_to_print = None
-                    continue
-            print_value_match = PRINT_INDICATOR_RE.match(line)
-            if print_value_match:
-                type_to_print = print_value_match[1]
-            elif type_to_print:
-                # Neither value indicator nor print indicator after a print indicator is an error.
-                raise Exception('No valid print statement: {}'.format(line))
-            elif END_INDICATOR_RE.search(line):
-                break
-        self._read_until_end_of_ctp_output(log)
-
-        if len(stack) != 1:
-            raise Exception('Incomplete print statement')
-        return stack.pop()
+        :param create_ctp: factory for the CTP instance of each source file
+        """
+        self._create_ctp = create_ctp
+        self._printers = []
+        self._parsers = {}
+        self._source_file = None
+        self._included_from = []
 
-    @staticmethod
-    def _read_until_end_of_ctp_output(log: Iterator[str]):
+    @property
+    def printers(self):
+        printers = self._printers
+        for parser in self._parsers.values():
+            printers.extend(parser.printers)
+            parser.printers.clear()
+        return printers
+
+    def parse_error_log(self, compiler_log: Iterator[str]):
+        """
+        Parses for print statements in the compiler log and collects them in printers.
+        :param compiler_log: the compiler_log
+        """
+        for printer in self.stream_error_log(compiler_log):
+            self._printers.append(printer)
+
+    def stream_error_log(self, compiler_log: Iterator[str]) -> Iterator[Union[PrintStatement, CompilerStatement]]:
+        """
+        Parses for print statements in the compiler log and yields each one as soon as it is complete.
+        :param compiler_log: the compiler_log
+        :return: the print and compiler statements
+        """
+        for line in compiler_log:
+            yield from self.feed(line)
+        yield from self.finish()
+
+    def feed(self, line: str) -> List[Union[PrintStatement, CompilerStatement]]:
+        """
+        Passes the next line of the compiler log to the parser of its source file.
+        :param line: the line
+        :return: the statements completed by this line
+        """
+        included_from_match = INCLUDED_FROM_FILE_RE.match(line)
+        if included_from_match:
+            # The source file is the last one of the include chain. Hold back the chain until it ends.
+            self._included_from.append(line)
+            if included_from_match[2] == ',':
+                return []
+            self._switch_source_file(included_from_match[1])
+            lines = self._included_from
+            self._included_from = []
+        else:
+            location_match = LOCATION_RE.match(line)
+            if location_match:
+                self._switch_source_file(location_match[1])
+            lines = [line]
+
+        parser = self._parser()
+        completed = []
+        for line in lines:
+            completed.extend(parser.feed(line))
+        return completed
+
+    def finish(self) -> List[Union[PrintStatement, CompilerStatement]]:
         """
-        Reads until the end of a fpermissive warning.
-        :param log: the print log
+        Completes parsing of all source files at the end of the compiler log.
+        :return: the remaining statements
         """
+        completed = []
+        if self._included_from:
+            parser = self._parser()
+            for line in self._included_from:
+                completed.extend(parser.feed(line))
+            self._included_from = []
+
+        if not any(parser.found_output for parser in self._parsers.values()):
+            completed.append(CompilerStatement('No CTP output found.\n'))
+        for parser in self._parsers.values():
+            completed.extend(parser.finish(report_missing_output=False))
+        return completed
+
+    def _switch_source_file(self, file: str):
+        if file == '<stdin>' or os.path.splitext(file)[1] in SOURCE_FILE_EXTENSIONS:
+            self._source_file = file
+
+    def _parser(self) -> CTP:
+        parser = self._parsers.get(self._source_file)
+        if parser is None:
+            parser = self._create_ctp()
+            self._parsers[self._source_file] = parser
+        return parser
+
+
+def _split_lines(rest: bytearray, data, size: int) -> Tuple[str, bytearray]:
+    """
+    Decodes all complete lines of the incomplete line read before and the new data.
+    :param rest: the incomplete line read before
+    :param data: buffer of the new data
+    :param size: number of bytes of the new data
+    :return: the complete lines and the new incomplete line
+    """
+    view = memoryview(data)
+    end = data.rfind(b'\n', 0, size) + 1
+    if not end:
+        rest += view[:size]
+        return '', rest
+    if rest:
+        rest += view[:end]
+        text = rest.decode('utf8', errors='surrogateescape')
+    else:
+        text = str(view[:end], 'utf8', errors='surrogateescape')
+    return text, bytearray(view[end:size])
+
+
+def read_lines(stream: BinaryIO, chunk_size: int = READ_CHUNK_SIZE, tee: BinaryIO = None,
+               arrival_time: List[float] = None) -> Iterator[str]:
+    """
+    Reads the lines of a binary stream in large chunks.
+    Invalid UTF-8 bytes are decoded as surrogates, so they survive printing with `errors='surrogateescape'`.
+    :param stream: the binary stream
+    :param chunk_size: maximal number of bytes read at once
+    :param tee: binary file the raw bytes are written to as well
+    :param arrival_time: monotonic time the chunk of the current line has been read
+    :return: the lines including their line break
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    rest = bytearray()
+    while True:
+        # Returns as soon as some bytes are available, so the log is still streamed.
+        size = stream.readinto1(view)
+        if not size:
+            break
+        if arrival_time:
+            arrival_time[0] = time.monotonic()
+        if tee:
+            tee.write(view[:size])
+        text, rest = _split_lines(rest, buffer, size)
+        yield from io.StringIO(text)
+    if rest:
+        yield rest.decode('utf8', errors='surrogateescape')
+
+
+def find_compiler(command: List[str]) -> Optional[int]:
+    """
+    :param command: the program and its arguments
+    :return: the index of GCC in the command, possibly run by a compiler launcher, or None for other programs
+    """
+    i = 0
+    while i < len(command) - 1 and os.path.basename(command[i]) in COMPILER_LAUNCHERS:
+        i += 1
+    if i >= len(command) or not GCC_RE.fullmatch(os.path.basename(command[i])):
+        return None
+    return i
+
+
+def inject_flags(command: List[str]) -> List[str]:
+    """
+    Adds the flags reducing the volume of the diagnostics and -fpermissive if missing right after the compiler of
+    recognized GCC invocations, so flags of the command still take precedence.
+    :param command: the program and its arguments
+    :return: the extended command, other programs are not changed
+    """
+    i = find_compiler(command)
+    if i is None:
+        return command
+    flags = [f for f in REDUCED_DIAGNOSTICS_FLAGS if f not in command]
+    if '-fpermissive' not in command and '-fno-permissive' not in command:
+        flags.append('-fpermissive')
+    return command[:i + 1] + flags + command[i + 1:]
+
+
+class LimitExceeded(Exception):
+    """
+    Raised if the compiler log exceeds the limits of --max-statements or --max-log-bytes.
+    """
+
+
+def limit_log(compiler_log: Iterator[str], max_bytes: int) -> Iterator[str]:
+    """
+    Passes the compiler log through until its size exceeds the limit.
+    :param compiler_log: the compiler log
+    :param max_bytes: maximal number of bytes of the compiler log
+    :return: the lines of the compiler log
+    """
+    size = 0
+    for line in compiler_log:
+        size += len(line.encode('utf8', errors='surrogateescape'))
+        if size > max_bytes:
+            raise LimitExceeded('compiler log exceeds {} bytes'.format(max_bytes))
+        yield line
+
+
+def limit_statements(statements: Iterator[Union[PrintStatement, CompilerStatement]],
+                     max_statements: int) -> Iterator[Union[PrintStatement, CompilerStatement]]:
+    """
+    Passes the statements through until the number of print statements exceeds the limit.
+    :param statements: the parsed statements
+    :param max_statements: maximal number of print statements
+    :return: the statements
+    """
+    count = 0
+    for statement in statements:
+        if isinstance(statement, PrintStatement):
+            count += 1
+            if count > max_statements:
+                raise LimitExceeded('more than {} print statements'.format(max_statements))
+        yield statement
+
+
+def stop_process_group(prog: Union[subprocess.Popen, asyncio.subprocess.Process], kill: bool = False):
+    """
+    Stops a command started in its own session together with the processes it started, e.g. the g++ driver and
+    cc1plus, which would otherwise keep compiling. Only the command itself is stopped if process groups are not
+    supported.
+    :param prog: the process of the command
+    :param kill: flag to kill instead of terminate the processes
+    """
+    if hasattr(os, 'killpg'):
         try:
-            while True:
-                line = next(log)
-                if IN_EXPANSION_OF_CTP_MACRO_RE.match(line):
-                    next(log)
-                    next(log)
-                    break
-        except StopIteration:
-            return
+            os.killpg(prog.pid, signal.SIGKILL if kill else signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    elif kill:
+        prog.kill()
+    else:
+        prog.terminate()
 
 
-def run_command(command: List[str], print_stdout: bool, return_code: List[int]) -> Iterator[str]:
+def run_command(command: List[str], print_stdout: bool, return_code: List[int], cwd: str = None,
+                save_log: BinaryIO = None, arrival_time: List[float] = None,
+                stdout_to_stderr: bool = False) -> Iterator[str]:
     """
     Runs the given command in a subprocess and returns the error log.
     :param command: the command to run
     :param print_stdout: flag to enable printing stdout
     :param return_code: return/status/exit code of the ran command
+    :param cwd: working directory of the command
+    :param save_log: binary file the raw error log is written to
+    :param arrival_time: monotonic time the current line of the error log has been read
+    :param stdout_to_stderr: flag to print stdout to the stderr of this process, e.g. if stdout carries JSON records
     :return: the error log
     """
     if command:
-        prog = subprocess.Popen(command, stdout=None if print_stdout else subprocess.PIPE, stderr=subprocess.PIPE)
-
-        for line in prog.stderr:
-            yield line.decode('utf8')
-        return_code[0] = prog.wait()
+        stdout = None if print_stdout else subprocess.PIPE
+        if print_stdout and stdout_to_stderr:
+            # File descriptor of the real stderr, sys.stderr may be replaced by a Python object.
+            stdout = 2
+        prog = subprocess.Popen(command, stdout=stdout, stderr=subprocess.PIPE, cwd=cwd, start_new_session=True)
+        completed = False
+        try:
+            yield from read_lines(prog.stderr, tee=save_log, arrival_time=arrival_time)
+            completed = True
+        finally:
+            # Stops the command if the error log is not read to the end.
+            if not completed and prog.poll() is None:
+                stop_process_group(prog)
+            prog.stderr.close()
+            return_code[0] = prog.wait()
     else:
-        for line in sys.stdin:
+        yield from read_lines(sys.stdin.buffer, tee=save_log, arrival_time=arrival_time)
+
+
+async def aread_lines(stream: asyncio.StreamReader, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[str]:
+    """
+    Reads the lines of an asyncio stream in large chunks, like `read_lines`.
+    :param stream: the stream
+    :param chunk_size: maximal number of bytes read at once
+    :return: the lines including their line break
+    """
+    rest = bytearray()
+    while True:
+        data = await stream.read(chunk_size)
+        if not data:
+            break
+        text, rest = _split_lines(rest, data, len(data))
+        for line in io.StringIO(text):
             yield line
+    if rest:
+        yield rest.decode('utf8', errors='surrogateescape')
+
+
+async def arun_command(command: List[str], print_stdout: bool, return_code: List[int],
+                       cwd: str = None) -> AsyncIterator[str]:
+    """
+    Runs the given command in an asyncio subprocess and returns the error log.
+    The subprocess is killed if the error log is not read to the end.
+    :param command: the command to run
+    :param print_stdout: flag to enable printing stdout
+    :param return_code: return/status/exit code of the ran command
+    :param cwd: working directory of the command
+    :return: the error log
+    """
+    prog = await asyncio.create_subprocess_exec(*command, stdout=None if print_stdout else asyncio.subprocess.DEVNULL,
+                                                stderr=asyncio.subprocess.PIPE, cwd=cwd, start_new_session=True)
+    completed = False
+    try:
+        async for line in aread_lines(prog.stderr):
+            yield line
+        completed = True
+    finally:
+        if not completed and prog.returncode is None:
+            stop_process_group(prog, kill=True)
+        return_code[0] = await prog.wait()
+
+
+async def run_many(commands: List[List[str]], create_ctp: Callable[[], 'CTP'], jobs: int = None,
+                   cwd: str = None) -> List[Tuple[List, int, Optional[str]]]:
+    """
+    Runs and parses the commands concurrently in one event loop.
+    :param commands: the commands to run
+    :param create_ctp: creates the parser of a command
+    :param jobs: maximal number of commands running at once, defaults to the number of processors
+    :param cwd: working directory of the commands
+    :return: the statements, the return code and the parse error if any of each command in the order of the commands
+    """
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+
+    async def run_one(command):
+        async with semaphore:
+            return_code = [0]
+            statements = []
+            error = None
+            try:
+                async for statement in create_ctp().arun(command, return_code, cwd):
+                    statements.append(statement)
+            except Exception as e:
+                error = str(e)
+            return statements, return_code[0], error
+
+    return await asyncio.gather(*(run_one(command) for command in commands))
 
 
 def parse_args(args: List):
@@ -413,12 +1159,57 @@ def parse_args(args: List):
                         help='removes matching regex from type info', default=[])
     parser.add_argument('-cr', '--capture-remove', action='append', type=str,
                         help='removes matching regex but keeps first capture-group from type info', default=[])
+    parser.add_argument('--combine-removes', action='store_true',
+                        help='removes matches of all --remove regex in a single pass')
     parser.add_argument('--time-point', action='store_true',
                         help='prints time point of each print statement')
+    parser.add_argument('--timeline', action='store_true',
+                        help='prints the time between consecutive print statements and a histogram of the gaps')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='output format, jsonl writes one JSON object per statement to stdout')
     parser.add_argument('--no-color', action='store_true',
                         help='disables colored error output stream')
     parser.add_argument('--hide-compiler-log', action='store_true',
                         help="don't print unparsed compiler log")
+    parser.add_argument('--no-inject-flags', action='store_true',
+                        help="don't add -fno-diagnostics-show-caret, -fno-diagnostics-color and -fpermissive to g++ "
+                             'commands')
+    parser.add_argument('--demultiplex', action='store_true',
+                        help='splits the interleaved compiler log of parallel builds (e.g. make -j) per source file')
+    parser.add_argument('--json-diagnostics', action='store_true',
+                        help='parses the structured diagnostics of GCC (-fdiagnostics-format=json or sarif-stderr), '
+                             'enabled if the flag is part of the program args')
+    parser.add_argument('--buffer-output', action='store_true',
+                        help='prints all statements after the program has finished instead of streaming them')
+    parser.add_argument('--max-statements', type=int, metavar='N',
+                        help='stops the compiler after N print statements and exits with code {}'.format(
+                            TRUNCATED_EXIT_CODE))
+    parser.add_argument('--max-log-bytes', type=int, metavar='N',
+                        help='stops the compiler once its log exceeds N bytes and exits with code {}'.format(
+                            TRUNCATED_EXIT_CODE))
+    parser.add_argument('--compile-commands', type=str, metavar='FILE',
+                        help='compiles and parses each entry of the compilation database in parallel')
+    parser.add_argument('--filter', type=str, metavar='GLOB',
+                        help='only uses entries of the compilation database whose source file matches')
+    parser.add_argument('--dedup', action='store_true',
+                        help='prints statements repeated by several entries of the compilation database (e.g. of a '
+                             'shared header) once, followed by the number and the list of the source files')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of parallel jobs for --compile-commands, defaults to the number of processors')
+    parser.add_argument('--watch', action='store_true',
+                        help='re-runs the translation units whose dependencies (collected with -MMD) change and prints '
+                             'the difference to their previous output')
+    parser.add_argument('--save-log', type=str, metavar='FILE',
+                        help='saves the raw compiler log, compressed if FILE ends with .gz')
+    parser.add_argument('--from-log', type=str, metavar='FILE',
+                        help='parses a compiler log saved with --save-log instead of running a program')
+    parser.add_argument('--cache', action='store_true',
+                        help='replays the statements of a previous run if the preprocessed source, the compiler and '
+                             'the flags are unchanged')
+    parser.add_argument('--cache-dir', type=str, metavar='DIR',
+                        help='directory of the cache, defaults to $XDG_CACHE_HOME/compile-time-printer')
+    parser.add_argument('--cache-size', type=int, metavar='MiB', default=100,
+                        help='maximal size of the cache, least recently used results are removed')
     parser.add_argument('program', type=str, nargs='?',
                         help='the program to compile the source', default=distinct_program)
     parser.add_argument('args', type=str, nargs='*',
@@ -439,11 +1230,58 @@ def parse_args(args: List):
     options = parser.parse_args(args)
     if options.program is not distinct_program:
         parser.error('program and args must be placed after --')
+    if options.compile_commands and prog_and_args is not None:
+        parser.error('--compile-commands cannot be combined with a program')
+    if options.from_log and (prog_and_args is not None or options.compile_commands or options.save_log):
+        parser.error('--from-log cannot be combined with a program, --compile-commands or --save-log')
+    if options.from_log and (options.time_point or options.timeline):
+        # The time the compiler log arrived is not saved.
+        parser.error('--from-log cannot be combined with --time-point or --timeline')
+    if options.save_log and options.compile_commands:
+        parser.error('--save-log cannot be combined with --compile-commands')
+    if options.cache:
+        from compile_time_printer.cache import reads_stdin, writes_files
+        if not prog_and_args or find_compiler(prog_and_args) is None:
+            parser.error('--cache requires a g++ command')
+        if reads_stdin(prog_and_args):
+            parser.error('--cache cannot be combined with a source read from stdin')
+        if writes_files(prog_and_args):
+            parser.error('--cache requires a -fsyntax-only command without output files (-c, -o, -MD, -MF, ...)')
+    if options.dedup and not options.compile_commands:
+        parser.error('--dedup requires --compile-commands')
+    if options.watch and (options.from_log or options.save_log or options.cache or options.demultiplex):
+        parser.error('--watch cannot be combined with --from-log, --save-log, --cache or --demultiplex')
+    if options.watch and not options.compile_commands and (not prog_and_args or find_compiler(prog_and_args) is None):
+        parser.error('--watch requires a g++ command or --compile-commands')
+    limited = options.max_statements is not None or options.max_log_bytes is not None
+    if limited and (options.compile_commands or options.watch):
+        parser.error('--max-statements and --max-log-bytes cannot be combined with --compile-commands or --watch')
+    if prog_and_args:
+        from compile_time_printer.json_diagnostics import uses_json_diagnostics
+        options.json_diagnostics = options.json_diagnostics or uses_json_diagnostics(prog_and_args)
+    if options.json_diagnostics and options.demultiplex:
+        parser.error('--demultiplex cannot be combined with JSON diagnostics')
 
     options.prog_and_args = prog_and_args
     return options
 
 
+def print_statement(printer: Union[PrintStatement, CompilerStatement], options, flush: bool = False, **fields):
+    """
+    Prints the statement in the output format given by the command line options.
+    :param printer: the statement
+    :param options: the command line options
+    :param flush: if the output stream should be flushed immediately
+    :param fields: additional fields of JSON records
+    """
+    if options.format == 'jsonl':
+        record = printer.record()
+        record.update(fields)
+        print(json.dumps(record), flush=flush)
+    else:
+        printer.print(options.time_point, not options.no_color, flush=flush)
+
+
 def dump_header_file():
     p = Path('ctp')
     p.mkdir(exist_ok=True)
@@ -464,21 +1302,130 @@ def main(args: List[str]):
         print('Header file has been placed under ctp/ctp.hpp.')
         return
 
-    # Run command.
+    if options.watch:
+        from compile_time_printer.watch import watch
+        watch(options)
+        return
+
+    if options.compile_commands:
+        from compile_time_printer.compile_commands import print_compile_commands
+        return_code = print_compile_commands(options)
+        if return_code != 0:
+            sys.exit(return_code)
+        return
+
+    # Reduce the compiler log to the lines needed for parsing.
+    if options.prog_and_args and not options.no_inject_flags:
+        options.prog_and_args = inject_flags(options.prog_and_args)
+
+    # Write undecodable bytes of the compiler log back unchanged.
+    for stream in (sys.stdout, sys.stderr):
+        if hasattr(stream, 'reconfigure'):
+            stream.reconfigure(errors='surrogateescape')
+
+    # Replay the statements of a previous run.
+    cache = cache_key = None
+    if options.cache:
+        from compile_time_printer.cache import ResultCache, default_cache_dir
+        cache = ResultCache(options.cache_dir or default_cache_dir(), options.cache_size * 2 ** 20)
+        cache_key = cache.key(options.prog_and_args, [options.remove, options.capture_remove,
+                                                      options.combine_removes, options.hide_compiler_log,
+                                                      options.json_diagnostics])
+        cached = cache_key and cache.load(cache_key)
+        if cached:
+            statements, cached_return_code = cached
+            for printer in statements:
+                print_statement(printer, options)
+            if options.timeline:
+                from compile_time_printer.timeline import print_timeline
+                print_timeline(statements)
+            if cached_return_code != 0:
+                sys.exit(cached_return_code)
+            return
+
+    # Run command or replay a saved log.
     return_code = [0]
-    log = run_command(options.prog_and_args, not options.hide_compiler_log, return_code)
+    save_log = None
+    # Print statements are timestamped when their log arrives, not when they are parsed.
+    arrival_time = [time.monotonic()]
+    if options.from_log:
+        from compile_time_printer.log_file import read_log_file
+        log = read_log_file(options.from_log)
+    else:
+        if options.save_log:
+            from compile_time_printer.log_file import create_log_file
+            save_log = create_log_file(options.save_log)
+        # Keeps stdout parseable as JSON lines, the output of the command (e.g. of make) goes to stderr.
+        log = run_command(options.prog_and_args, not options.hide_compiler_log, return_code, save_log=save_log,
+                          arrival_time=arrival_time, stdout_to_stderr=options.format == 'jsonl')
+    compiler_log = log
+    if options.max_log_bytes is not None:
+        log = limit_log(log, options.max_log_bytes)
 
     # Parse output.
-    type_prettifier = TypePrettifier(options.remove, options.capture_remove)
-    ctp = CTP(type_prettifier, not options.hide_compiler_log)
+    type_prettifier = TypePrettifier(options.remove, options.capture_remove, options.combine_removes)
+
+    parser_class = CTP
+    if options.json_diagnostics:
+        from compile_time_printer.json_diagnostics import JsonCTP
+        parser_class = JsonCTP
+
+    # Parsers of the demultiplexer are created at the first line of their source file, but share the start time.
+    start_time = arrival_time[0]
+
+    def create_ctp():
+        return parser_class(type_prettifier, not options.hide_compiler_log, clock=lambda: arrival_time[0],
+                            start_time=start_time)
+
+    ctp = Demultiplexer(create_ctp) if options.demultiplex else create_ctp()
+    statements = ctp.stream_error_log(log)
+    if options.max_statements is not None:
+        statements = limit_statements(statements, options.max_statements)
+    collect = cache_key or options.timeline
+    printed = []
+    buffered = []
+    truncated = None
     try:
-        ctp.parse_error_log(log)
+        for printer in statements:
+            if options.buffer_output:
+                buffered.append(printer)
+                continue
+            # Print each statement as soon as it is parsed.
+            print_statement(printer, options, flush=True)
+            if collect:
+                printed.append(printer)
+    except LimitExceeded as e:
+        truncated = e
+        # Stops the compiler instead of waiting for the rest of its log.
+        compiler_log.close()
     except Exception as e:
         return_code[0] = e
+        if save_log:
+            # Save the whole log to reproduce the error.
+            for _ in log:
+                pass
+    finally:
+        if save_log:
+            save_log.close()
 
-    # Iterate over printers and print.
-    for printer in ctp.printers:
-        printer.print(options.time_point, not options.no_color)
+    # Iterate over remaining printers and print.
+    remaining = buffered + ctp.printers
+    for i, printer in enumerate(remaining):
+        try:
+            print_statement(printer, options)
+        except Exception as e:
+            # Messages are formatted when printed, e.g. an invalid format string of ctp::printf fails here.
+            remaining = remaining[:i]
+            return_code[0] = e
+            break
+    if cache_key and not truncated and not isinstance(return_code[0], Exception):
+        cache.store(cache_key, printed + remaining, return_code[0])
+    if options.timeline:
+        from compile_time_printer.timeline import print_timeline
+        print_timeline(printed + remaining)
+    if truncated:
+        print('Output truncated: {}, the compiler has been stopped.'.format(truncated), file=sys.stderr, flush=True)
+        sys.exit(TRUNCATED_EXIT_CODE)
     if return_code[0] != 0:
         sys.exit(return_code[0])
 
@@ -491,4 +1438,10 @@ def run():
 
 
 if __name__ == '__main__':
-    run()
+    try:
+        # Runs the module of the package instead of this copy, so lazily imported modules of the package and the
+        # statements pickled by their workers use the same classes.
+        from compile_time_printer.ctp import run as package_run
+    except ImportError:
+        package_run = run
+    package_run()
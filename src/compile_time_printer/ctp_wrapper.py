@@ -1,5 +1,11 @@
 import re
 
+try:
+    from compile_time_printer.ctp import CTP, PrintStatement, TypePrettifier
+except ImportError:
+    # The web playground runs ctp.py and this file in the same global namespace of Pyodide.
+    pass
+
 COMPILER_ERROR_WARNING_MESSAGE = re.compile(r'(<source>:)(\d+)')
 COMPILER_ERROR_WARNING_MESSAGE_DETAIL = re.compile(r'^([ ]+)(\d+)([ ]+\|[ ]+)')
 
@@ -10,15 +16,20 @@ class CTPHelper:
 
     def parse(self, log, show_compiler_log):
         error = None
-        ctp = CTP(TypePrettifier([], []), show_compiler_log)  # noqa
+        ctp = CTP(TypePrettifier([], []), show_compiler_log)
         try:
-            ctp.parse_error_log(iter(log))  # noqa
+            ctp.parse_error_log(iter(log))
         except Exception as e:
             error = {'message': str(e), 'error_output': True, 'compiler_output': True}
 
         result = []
         for printer in ctp.printers:
-            result.append(self._prepare(printer))
+            try:
+                result.append(self._prepare(printer))
+            except Exception as e:
+                # Messages are formatted when serialized, e.g. an invalid format string of ctp::printf fails here.
+                error = error or {'message': str(e), 'error_output': True, 'compiler_output': True}
+                break
 
         if error:
             result.append(error)
@@ -26,7 +37,7 @@ class CTPHelper:
 
     def _prepare(self, printer):
         message, error_output = printer.serialize()
-        if isinstance(printer, PrintStatement):  # noqa
+        if isinstance(printer, PrintStatement):
             return {'message': message, 'error_output': error_output, 'compiler_output': False}
 
         # Fix line number for compiler messages.
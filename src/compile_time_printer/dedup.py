@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sys
+from typing import List, NamedTuple, Optional, TextIO
+
+from compile_time_printer.ctp import PrintStatement
+from compile_time_printer.timeline import summarize_message
+
+# Bytes of the hash identifying a print statement.
+DIGEST_SIZE = 16
+
+
+def statement_digest(statement: PrintStatement, location: Optional[str]) -> bytes:
+    """
+    :param statement: the print statement
+    :param location: the absolute location of the call, if known
+    :return: the hash of the location, the output stream and the message
+    """
+    message, is_stderr = statement.serialize()
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    h.update((location or '').encode('utf8', errors='surrogateescape'))
+    h.update(b'\0e\0' if is_stderr else b'\0o\0')
+    h.update(message.encode('utf8', errors='surrogateescape'))
+    return h.digest()
+
+
+def absolute_location(location: Optional[str], directory: str) -> Optional[str]:
+    """
+    :param location: file, line and column relative to the working directory of the compiler
+    :param directory: the working directory of the compiler
+    :return: the location with an absolute file, so it is the same for all translation units
+    """
+    if location is None:
+        return None
+    file, line, column = location.rsplit(':', 2)
+    return '{}:{}:{}'.format(os.path.normpath(os.path.join(directory, file)), line, column)
+
+
+class Repetition(NamedTuple):
+    """
+    Print statement printed by several translation units.
+    """
+    location: Optional[str]
+    message: str
+    files: List[str]
+
+
+class Deduplicator:
+    """
+    Finds print statements printed before by another translation unit, e.g. of a header included by several.
+    Only a hash of each statement and the index of the first translation unit printing it are kept, statements are
+    stored once they are printed by a second one.
+    """
+
+    def __init__(self):
+        self._first_file = {}
+        self._repetitions = {}
+        self._files = []
+
+    def start_file(self, file: str):
+        """
+        Starts the statements of the next translation unit.
+        :param file: the source file of the translation unit
+        """
+        self._files.append(file)
+
+    def is_repeated(self, statement: PrintStatement, directory: str) -> bool:
+        """
+        :param statement: the print statement of the current translation unit
+        :param directory: working directory of the compiler
+        :return: if another translation unit has printed the same statement at the same location before
+        """
+        location = absolute_location(statement._location, directory)
+        digest = statement_digest(statement, location)
+        file_index = len(self._files) - 1
+        first = self._first_file.setdefault(digest, file_index)
+        if first == file_index:
+            # Statements printed repeatedly by one translation unit are part of its output.
+            return False
+        repetition = self._repetitions.get(digest)
+        if repetition is None:
+            repetition = self._repetitions[digest] = Repetition(location, statement.serialize()[0],
+                                                                [self._files[first]])
+        if repetition.files[-1] != self._files[file_index]:
+            repetition.files.append(self._files[file_index])
+        return True
+
+    @property
+    def repetitions(self) -> List[Repetition]:
+        return list(self._repetitions.values())
+
+
+def print_repetitions(repetitions: List[Repetition], file: TextIO = sys.stdout):
+    """
+    Prints each print statement printed by several translation units with the number and the list of them.
+    :param repetitions: the repeated print statements
+    :param file: the output stream
+    """
+    if not repetitions:
+        return
+    print('==> Printed by several translation units <==', file=file)
+    for repetition in repetitions:
+        print('{}x {}{}'.format(len(repetition.files), repetition.location + ': ' if repetition.location else '',
+                                summarize_message(repetition.message)), file=file)
+        print('   {}'.format(', '.join(repetition.files)), file=file)
@@ -0,0 +1,202 @@
+import json
+import re
+import sys
+from typing import Iterator, List, Union
+
+from compile_time_printer.ctp import CTP, VALUE_INDICATOR_RE, CompilerStatement, Indicator, PrintStatement, ValueStack
+
+# Values of -fdiagnostics-format writing structured diagnostics to stderr.
+JSON_DIAGNOSTICS_FORMATS = ('json', 'json-stderr', 'sarif-stderr')
+
+# Strings of JSON text. Strings never span lines, so the nesting depth can be tracked by the brackets of each line.
+JSON_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+# Whitespace and the brackets and commas of the top level array between diagnostics.
+JSON_SEPARATOR_RE = re.compile(r'[\s\[\],]*')
+
+# Warning of the C++ header indicating the protocol version. The quotes depend on the locale.
+VERSION_WARNING_RE = re.compile(r'unused variable .version.$')
+
+START_INDICATORS = {Indicator.StartOut, Indicator.StartErr, Indicator.StartOutFormat, Indicator.StartErrFormat}
+
+INTEGER_WARNING = 'Warning: GCC omits the types in JSON diagnostics, chars and bools are printed as integers.\n'
+
+
+def uses_json_diagnostics(command: List[str]) -> bool:
+    """
+    :param command: the compiler and its arguments
+    :return: if the compiler writes structured diagnostics to stderr
+    """
+    return any(arg.startswith('-fdiagnostics-format=') and arg.split('=', 1)[1] in JSON_DIAGNOSTICS_FORMATS
+               for arg in command)
+
+
+def _sarif_location(location: dict) -> dict:
+    physical = location.get('physicalLocation', {})
+    region = physical.get('region', {})
+    return {'caret': {'file': physical.get('artifactLocation', {}).get('uri', ''), 'line': region.get('startLine'),
+                      'column': region.get('startColumn')}}
+
+
+def sarif_diagnostics(document: dict) -> Iterator[dict]:
+    """
+    Converts the results of a SARIF log to diagnostics in the layout of -fdiagnostics-format=json.
+    :param document: the SARIF log
+    :return: the diagnostics
+    """
+    for run in document.get('runs', []):
+        for result in run.get('results', []):
+            yield {'kind': result.get('level', 'warning'), 'message': result.get('message', {}).get('text', ''),
+                   'option': result.get('ruleId'),
+                   'locations': [_sarif_location(location) for location in result.get('locations', [])],
+                   'children': []}
+
+
+def _location_file(diagnostic: dict) -> str:
+    locations = diagnostic.get('locations')
+    return locations[0].get('caret', {}).get('file', '') if locations else ''
+
+
+def format_diagnostic(diagnostic: dict) -> str:
+    """
+    Formats a diagnostic and its children like the text format of GCC, without source snippets.
+    :param diagnostic: the diagnostic
+    :return: the lines of the diagnostic
+    """
+    location = ''
+    locations = diagnostic.get('locations')
+    if locations:
+        caret = locations[0].get('caret', {})
+        location = '{}:{}:{}: '.format(caret.get('file'), caret.get('line'), caret.get('column'))
+    option = diagnostic.get('option')
+    text = '{}{}: {}{}\n'.format(location, diagnostic.get('kind'), diagnostic.get('message'),
+                                 ' [{}]'.format(option) if option else '')
+    return text + ''.join(format_diagnostic(child) for child in diagnostic.get('children', []))
+
+
+class JsonCTP(CTP):
+    """
+    Parses the structured diagnostics of GCC (-fdiagnostics-format=json or sarif-stderr) instead of the text log.
+    Each diagnostic is decoded as soon as it is complete and the values are taken from the messages of the shift
+    warnings, so neither source snippets nor the layout of the text log matter.
+    GCC omits the instantiation context in structured diagnostics. Therefore types can't be printed, chars and bools
+    are printed as integers (with a warning before the first integer) and the protocol version of the C++ header can't
+    be checked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._decoder = json.JSONDecoder()
+        self._pending = []
+        self._depth = 0
+        self._header_file = None
+        self._warned_integers = False
+        self._state = self._read_json
+
+    def finish(self, report_missing_output: bool = True) -> List[Union[PrintStatement, CompilerStatement]]:
+        """
+        Completes parsing at the end of the compiler log.
+        :param report_missing_output: flag to add a message if no CTP output has been found
+        :return: the remaining statements
+        """
+        if self._depth > 1:
+            raise Exception('Incomplete JSON diagnostics')
+        self._decode_pending()
+        if self._stack is not None:
+            self._complete_print_statement()
+
+        if self._not_available and report_missing_output:
+            self._completed.append(CompilerStatement('No CTP output found.\n'))
+
+        completed = self._completed
+        self._completed = []
+        return completed
+
+    def _read_json(self, line: str):
+        if self._depth == 0:
+            if not line.lstrip().startswith(('[', '{')):
+                # Output of other programs, e.g. the build system.
+                self._append_compiler_statement(line)
+                return
+            # GCC writes all diagnostics in one line, which is decoded at once.
+            try:
+                document = self._decoder.decode(line)
+            except ValueError:
+                pass
+            else:
+                for diagnostic in document if isinstance(document, list) else [document]:
+                    self._read_document(diagnostic)
+                return
+        brackets = JSON_STRING_RE.sub('', line)
+        self._depth += brackets.count('[') + brackets.count('{') - brackets.count(']') - brackets.count('}')
+        self._pending.append(line)
+        # All diagnostics started so far are complete.
+        if self._depth <= 1:
+            self._decode_pending()
+
+    def _decode_pending(self):
+        text = ''.join(self._pending)
+        self._pending = []
+        pos = JSON_SEPARATOR_RE.match(text).end()
+        while pos < len(text):
+            try:
+                document, pos = self._decoder.raw_decode(text, pos)
+            except ValueError as e:
+                raise Exception('Invalid JSON diagnostics: {}'.format(e))
+            self._read_document(document)
+            pos = JSON_SEPARATOR_RE.match(text, pos).end()
+
+    def _read_document(self, document: dict):
+        if 'runs' in document:
+            for diagnostic in sarif_diagnostics(document):
+                self._read_diagnostic(diagnostic)
+        else:
+            self._read_diagnostic(document)
+
+    def _read_diagnostic(self, diagnostic: dict):
+        message = diagnostic.get('message', '')
+        file = _location_file(diagnostic)
+        if file.endswith('ctp.hpp') and VERSION_WARNING_RE.match(message):
+            # Indicates the C++ header, but the protocol version is not part of the message.
+            self._header_file = file
+            self._not_available = False
+            return
+        value_match = VALUE_INDICATOR_RE.search(message) if file == self._header_file else None
+        if not value_match:
+            self._append_compiler_statement(format_diagnostic(diagnostic))
+        elif diagnostic.get('kind') == 'error':
+            raise Exception('Parsing not possible. Did you forget -fpermissive?')
+        else:
+            # GCC prints values exceeding 64 bits in hexadecimal.
+            self._read_indicator(int(value_match[1], 0), int(value_match[2]))
+
+    def _read_indicator(self, number: int, indicator: int):
+        if indicator in START_INDICATORS:
+            if self._stack is not None:
+                raise Exception('No valid print statement: start indicator before end indicator')
+            self._time_diff = self._clock() - self._start_time
+            self._output_stream = sys.stdout if indicator in [Indicator.StartOut,
+                                                              Indicator.StartOutFormat] else sys.stderr
+            self._format_str = indicator in [Indicator.StartOutFormat, Indicator.StartErrFormat]
+            self._stack = ValueStack()
+        elif self._stack is None:
+            raise Exception('No valid start indicator: {}'.format(indicator))
+        elif indicator == Indicator.End:
+            self._complete_print_statement()
+        elif indicator == Indicator.Type:
+            raise Exception('Types cannot be printed with JSON diagnostics, GCC omits the instantiation context')
+        else:
+            if indicator == Indicator.PositiveInteger and not self._warned_integers and \
+                    type(self._stack[-1]) is not bytearray:
+                # Characters of strings are decoded correctly, other chars and bools can't be told from integers.
+                self._completed.append(CompilerStatement(INTEGER_WARNING))
+                self._warned_integers = True
+            self._stack.decode(None, number, indicator, self._type_prettifier)
+
+    def _complete_print_statement(self):
+        self._completed.append(PrintStatement(self._time_diff, self._format_str, self._output_stream,
+                                              self._stack.arguments()))
+        self._stack = None
+
+    def _append_compiler_statement(self, message: str):
+        if self._print_compiler_log:
+            self._completed.append(CompilerStatement(message))
@@ -0,0 +1,52 @@
+import gzip
+import io
+import mmap
+from typing import BinaryIO, Iterator
+
+from compile_time_printer.ctp import READ_CHUNK_SIZE, read_lines
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith('.gz')
+
+
+def create_log_file(path: str) -> BinaryIO:
+    """
+    Creates a file to save the raw compiler log to.
+    :param path: path of the log file, it is compressed with gzip if it ends with .gz
+    :return: the binary file
+    """
+    if is_compressed(path):
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def read_log_file(path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads the lines of a saved compiler log without loading the whole file into memory.
+    Uncompressed files are memory-mapped, compressed files are decompressed on the fly.
+    :param path: path of the log file
+    :param chunk_size: number of bytes decoded at once
+    :return: the lines including their line break
+    """
+    if is_compressed(path):
+        with gzip.open(path, 'rb') as f:
+            yield from read_lines(f, chunk_size)
+        return
+
+    with open(path, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+        if size == 0:
+            # Empty files cannot be mapped.
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            start = 0
+            while start < size:
+                limit = start + chunk_size
+                if limit >= size:
+                    end = size
+                else:
+                    # Split after the last line break of the chunk or, for overlong lines, after the next one.
+                    end = log.rfind(b'\n', start, limit) + 1 or log.find(b'\n', limit) + 1 or size
+                yield from io.StringIO(str(log[start:end], 'utf8', errors='surrogateescape'))
+                start = end
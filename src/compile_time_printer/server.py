@@ -0,0 +1,327 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional, Tuple
+
+from compile_time_printer.ctp import __version__, stop_process_group
+from compile_time_printer.ctp_wrapper import parse
+
+# Path of the compile endpoint of the Compiler Explorer (godbolt.org) API.
+COMPILE_PATH_RE = re.compile(r'/api/compiler/([^/?]+)/compile')
+MAX_REQUEST_SIZE = 1 << 20
+# Origin of the web playground, the only web page allowed to send requests by default.
+PLAYGROUND_ORIGIN = 'https://viatorus.github.io'
+# Compiler flags of requests. Flags reading or writing other files, loading plugins or running other programs (e.g.
+# -wrapper, -fplugin=, -B, -Wl, or @file) are rejected, since the server runs the compiler on behalf of a web page.
+ALLOWED_FLAG_RE = re.compile(r'-(?:std=[\w+]+|O(?:[0-3sgz]|fast)?|g\d?|w|W[\w=+-]*|pedantic(?:-errors)?|'
+                             r'fsyntax-only|fpermissive|fno-[\w-]+|fdiagnostics-[\w=-]+|fconstexpr-[\w-]+=\d+|'
+                             r'ftemplate-[\w-]+=\d+|fconcepts[\w-]*|fcoroutines|fchar8_t|[DU]\w+(?:=\S*)?|m[\w=+-]+)')
+# Name of the source file, which godbolt.org uses as well and the web playground expects in the compiler log.
+SOURCE_FILE = '<source>'
+# Directory of the C++ header in the installed package.
+INCLUDE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include')
+WARM_UP_SOURCE = '#include <ctp/ctp.hpp>\nconstexpr auto i = ctp::print(1);\n'
+
+
+class CompilerPool:
+    """
+    Runs the compilers of the requests of all sessions, at most `jobs` at once. A request of a session supersedes the
+    previous one of the same session, which is cancelled while waiting or killed while compiling.
+    """
+
+    def __init__(self, compilers: Dict[str, str], default_compiler: str, jobs: int, timeout: float):
+        """
+        :param compilers: the compiler of each compiler id of the API
+        :param default_compiler: compiler of unknown compiler ids
+        :param jobs: maximal number of compilers running at once
+        :param timeout: seconds after which a compiler is killed
+        """
+        self._compilers = compilers
+        self._default_compiler = default_compiler
+        self._slots = threading.BoundedSemaphore(jobs)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._latest = {}
+        self._running = {}
+        self._directory = tempfile.TemporaryDirectory(prefix='ctp-server-')
+
+    def close(self):
+        self._directory.cleanup()
+
+    def command(self, compiler_id: str, user_arguments: str) -> List[str]:
+        """
+        :param compiler_id: the compiler id of the API
+        :param user_arguments: the compiler flags
+        :return: the command compiling the source file in the working directory
+        :raises ValueError: if a compiler flag is not allowed
+        """
+        compiler = self._compilers.get(compiler_id, self._default_compiler)
+        flags = shlex.split(user_arguments)
+        for flag in flags:
+            if not ALLOWED_FLAG_RE.fullmatch(flag):
+                raise ValueError('Compiler flag not allowed: {}'.format(flag))
+        include = ['-I', INCLUDE_DIR] if os.path.isdir(INCLUDE_DIR) else []
+        return [compiler, *flags, *include, '-xc++', SOURCE_FILE]
+
+    def _is_superseded(self, session: Optional[str], request_id: int) -> bool:
+        return session is not None and self._latest.get(session) != request_id
+
+    def compile(self, compiler_id: str, source: str, user_arguments: str,
+                session: Optional[str] = None) -> Optional[Tuple[int, List[str]]]:
+        """
+        Compiles the source once a compiler slot is free.
+        :param compiler_id: the compiler id of the API
+        :param source: the source code
+        :param user_arguments: the compiler flags
+        :param session: identifies the client, newer requests of the same client cancel this one
+        :return: the return code and the lines of the compiler log, or None if the request has been superseded
+        :raises ValueError: if a compiler flag is not allowed
+        """
+        command = self.command(compiler_id, user_arguments)
+        with self._lock:
+            request_id = next(self._ids)
+            if session is not None:
+                self._latest[session] = request_id
+                previous = self._running.pop(session, None)
+                if previous:
+                    stop_process_group(previous, kill=True)
+
+        with self._slots, tempfile.TemporaryDirectory(dir=self._directory.name) as directory:
+            with open(os.path.join(directory, SOURCE_FILE), 'w', encoding='utf8') as f:
+                f.write(source)
+            with self._lock:
+                if self._is_superseded(session, request_id):
+                    return None
+                # The compiler runs in its own session, so cc1plus is stopped together with the driver.
+                prog = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE, cwd=directory, start_new_session=True)
+                if session is not None:
+                    self._running[session] = prog
+            try:
+                _, log = prog.communicate(timeout=self._timeout)
+                timed_out = False
+            except subprocess.TimeoutExpired:
+                stop_process_group(prog, kill=True)
+                _, log = prog.communicate()
+                timed_out = True
+            finally:
+                with self._lock:
+                    if self._running.get(session) is prog:
+                        del self._running[session]
+                    superseded = self._is_superseded(session, request_id)
+                    if session is not None and not superseded:
+                        del self._latest[session]
+
+        if superseded:
+            return None
+        lines = log.decode('utf8', errors='replace').splitlines()
+        if timed_out:
+            lines.append('Compilation has been stopped after {:g}s.'.format(self._timeout))
+        return prog.returncode, lines
+
+    def warm_up(self):
+        """
+        Compiles the C++ header once, so the compiler and the standard headers are in the file system cache.
+        """
+        self.compile('', WARM_UP_SOURCE, '-std=c++17 -fsyntax-only -fpermissive')
+
+
+def parse_request(body) -> Tuple[str, str, Optional[str], Optional[dict]]:
+    """
+    Validates the JSON body of a compile request.
+    :param body: the decoded JSON body
+    :return: the source, the compiler flags, the session and the ctp options with defaults, if any
+    :raises ValueError: if the request is malformed
+    """
+    if not isinstance(body, dict):
+        raise ValueError('the request must be an object')
+    source = body.get('source')
+    options = body.get('options', {})
+    user_arguments = options.get('userArguments', '') if isinstance(options, dict) else None
+    session = body.get('session')
+    if not isinstance(source, str):
+        raise ValueError("'source' must be a string")
+    if not isinstance(user_arguments, str):
+        raise ValueError("'options' must be an object with the string 'userArguments'")
+    if session is not None and not isinstance(session, str):
+        raise ValueError("'session' must be a string")
+
+    ctp_options = body.get('ctp')
+    if ctp_options is None:
+        return source, user_arguments, session, None
+    if not isinstance(ctp_options, dict):
+        raise ValueError("'ctp' must be an object")
+    include_offset = ctp_options.get('include_offset', [0, 0])
+    show_compiler_log = ctp_options.get('show_compiler_log', True)
+    # Booleans are integers in Python, but not in JSON.
+    if not isinstance(include_offset, list) or len(include_offset) != 2 or \
+            any(type(i) is not int for i in include_offset):
+        raise ValueError("'ctp.include_offset' must be a list of two integers")
+    if not isinstance(show_compiler_log, bool):
+        raise ValueError("'ctp.show_compiler_log' must be a boolean")
+    return source, user_arguments, session, {'include_offset': include_offset, 'show_compiler_log': show_compiler_log}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CompileRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the compile endpoint of the Compiler Explorer API used by the web playground. If the request contains
+    'ctp' options, the compiler log is parsed as well and the statements are returned in 'ctp'.
+    """
+    server_version = 'compile-time-printer/{}'.format(__version__)
+
+    def do_OPTIONS(self):
+        # Preflight request of browsers for cross-origin requests.
+        if self._check_origin():
+            self._send(204, None)
+
+    def do_POST(self):
+        if not self._check_origin():
+            return
+        match = COMPILE_PATH_RE.fullmatch(self.path.split('?', 1)[0])
+        if not match:
+            self._send(404, {'error': 'Unknown path: {}'.format(self.path)})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_SIZE:
+            self._send(413, {'error': 'Request exceeds {} bytes'.format(MAX_REQUEST_SIZE)})
+            return
+        try:
+            source, user_arguments, session, ctp_options = parse_request(
+                json.loads(self.rfile.read(length).decode('utf8')))
+        except ValueError as e:
+            # Also invalid JSON or UTF-8.
+            self._send(400, {'error': 'Invalid request: {}'.format(e)})
+            return
+
+        session = session or self.headers.get('X-CTP-Session')
+        try:
+            result = self.server.pool.compile(match[1], source, user_arguments, session)
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+            return
+        if result is None:
+            self._send(409, {'error': 'Superseded by a newer request of the same session'})
+            return
+        return_code, log = result
+        response = {'code': return_code, 'stdout': [], 'stderr': [{'text': line} for line in log]}
+        if ctp_options is not None:
+            response['ctp'] = parse(ctp_options['include_offset'], log, ctp_options['show_compiler_log'])
+        self._send(200, response)
+
+    def _check_origin(self) -> bool:
+        # Browsers send the origin of the web page with each cross-origin request. Requests of other clients, e.g. curl,
+        # have none and could run the compiler anyway.
+        origin = self.headers.get('Origin')
+        if origin is not None and origin not in self.server.allowed_origins:
+            self._send(403, {'error': 'Origin not allowed: {}'.format(origin)})
+            return False
+        return True
+
+    def _send(self, status: int, body: Optional[dict]):
+        data = json.dumps(body).encode('utf8') if body is not None else b''
+        self.send_response(status)
+        origin = self.headers.get('Origin')
+        if origin in self.server.allowed_origins:
+            self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'accept, content-type, x-ctp-session')
+            # Allows the web playground served over the internet to access the server on the loopback interface.
+            self.send_header('Access-Control-Allow-Private-Network', 'true')
+        self.send_header('Vary', 'Origin')
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(host: str, port: int, pool: CompilerPool, allowed_origins: List[str] = (PLAYGROUND_ORIGIN,),
+                  verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    :param host: the address to listen on
+    :param port: the port to listen on, 0 picks a free one
+    :param pool: the compilers
+    :param allowed_origins: origins of the web pages allowed to send requests
+    :param verbose: flag to log each request
+    :return: the server, which is not started yet
+    """
+    server = ThreadingHTTPServer((host, port), CompileRequestHandler)
+    server.pool = pool
+    server.allowed_origins = set(allowed_origins)
+    server.verbose = verbose
+    return server
+
+
+def parse_args(args: List[str]):
+    """
+    Parses the command line parameters.
+    :param args: command line parameters
+    :return: `argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='compile-time-printer-server',
+        description='Local compile backend of the web playground, serving the compile endpoint of the Compiler '
+                    'Explorer API. Only web pages of the allowed origins can send requests and only compiler flags '
+                    'without side effects are accepted.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=10240, help='port to listen on')
+    parser.add_argument('--compiler', action='append', metavar='[ID=]PATH', default=[],
+                        help='compiler of a compiler id of the API, the one without id (otherwise g++) is used for '
+                             'all other ids')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='maximal number of compilers running at once')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds after which a compiler is stopped')
+    parser.add_argument('--allow-origin', action='append', metavar='ORIGIN', default=[],
+                        help='origin of a web page allowed to send requests besides {}, e.g. http://localhost:8080 of '
+                             'a local build of the web playground'.format(PLAYGROUND_ORIGIN))
+    parser.add_argument('--verbose', action='store_true', help='logs each request')
+    return parser.parse_args(args)
+
+
+def main(args: List[str]):
+    options = parse_args(args)
+    compilers = dict(c.split('=', 1) for c in options.compiler if '=' in c)
+    default_compiler = next((c for c in options.compiler if '=' not in c), 'g++')
+    pool = CompilerPool(compilers, default_compiler, options.jobs, options.timeout)
+    server = create_server(options.host, options.port, pool, [PLAYGROUND_ORIGIN, *options.allow_origin],
+                           options.verbose)
+    threading.Thread(target=pool.warm_up, daemon=True).start()
+    print('Serving on http://{}:{}, open the web playground with ?backend=http://{}:{}'.format(
+        *server.server_address[:2], *server.server_address[:2]), file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+def run():
+    """
+    Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == '__main__':
+    run()
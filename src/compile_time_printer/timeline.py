@@ -0,0 +1,65 @@
+import math
+import sys
+from typing import List, TextIO
+
+from compile_time_printer.ctp import PrintStatement
+
+# Upper bounds of the gap histogram buckets in seconds.
+GAP_BUCKETS = [0.001, 0.01, 0.1, 1, 10, math.inf]
+MAX_MESSAGE_WIDTH = 60
+MAX_BAR_WIDTH = 40
+
+
+def format_seconds(seconds: float) -> str:
+    return '{:.3f}s'.format(seconds)
+
+
+def format_bucket(bound: float) -> str:
+    if bound == math.inf:
+        return '>= {}'.format(format_bucket(GAP_BUCKETS[-2])[2:])
+    if bound < 1:
+        return '< {:g}ms'.format(bound * 1000)
+    return '< {:g}s'.format(bound)
+
+
+def summarize_message(message: str) -> str:
+    message = message.strip().split('\n', 1)[0]
+    if len(message) > MAX_MESSAGE_WIDTH:
+        message = message[:MAX_MESSAGE_WIDTH - 3] + '...'
+    return message
+
+
+def print_timeline(statements: List, file: TextIO = sys.stderr):
+    """
+    Prints the time points of all print statements, the gaps between consecutive ones and a histogram of the gaps.
+    :param statements: the parsed statements, compiler statements are ignored
+    :param file: the output stream
+    """
+    statements = [s for s in statements if isinstance(s, PrintStatement)]
+    print('Timeline:', file=file)
+    if not statements:
+        print('  no print statements', file=file)
+        return
+
+    gaps = []
+    previous = 0.0
+    for statement in statements:
+        time_point = statement._time_point
+        gap = time_point - previous
+        gaps.append(gap)
+        previous = time_point
+        print('  {:>10} {:>11}  {}'.format(format_seconds(time_point), '+' + format_seconds(gap),
+                                           summarize_message(statement.serialize()[0])), file=file)
+
+    counts = [0] * len(GAP_BUCKETS)
+    for gap in gaps:
+        counts[next(i for i, bound in enumerate(GAP_BUCKETS) if gap < bound)] += 1
+
+    print('Gaps:', file=file)
+    largest = max(counts)
+    for bound, count in zip(GAP_BUCKETS, counts):
+        bar = '#' * math.ceil(count * MAX_BAR_WIDTH / largest)
+        print('  {:>8} {:>6} {}'.format(format_bucket(bound), count, bar).rstrip(), file=file)
+    slowest = max(range(len(gaps)), key=gaps.__getitem__)
+    print('Largest gap: {} before "{}"'.format(format_seconds(gaps[slowest]),
+                                               summarize_message(statements[slowest].serialize()[0])), file=file)
@@ -0,0 +1,337 @@
+import ctypes
+import difflib
+import errno
+import os
+import re
+import select
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, List, Optional, Set, Tuple
+
+from compile_time_printer.compile_commands import CompileCommand, add_required_flags, load_compile_commands, \
+    parse_command
+from compile_time_printer.ctp import SOURCE_FILE_EXTENSIONS, CompilerStatement, TypePrettifier, inject_flags, \
+    print_statement
+
+# Tokens of a depfile: paths with escaped characters and targets ending with a colon.
+DEPFILE_TOKEN_RE = re.compile(r'(?:\\.|\$\$|[^\s\\])+')
+DEPFILE_ESCAPE_RE = re.compile(r'\\([ #\\:])|\$(\$)')
+
+# Seconds between two checks of the modification times if inotify is not available.
+POLL_INTERVAL = 0.5
+# Seconds to wait for further changes, e.g. of an editor saving several files at once.
+DEBOUNCE_DELAY = 0.1
+
+# inotify flags and events (see inotify(7)). Directories are watched, since editors often save by renaming a
+# temporary file, which would end the watch of the file itself.
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+WATCH_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_BUFFER_SIZE = 1 << 16
+
+
+def parse_depfile(text: str, directory: str) -> Set[str]:
+    """
+    Parses the make rules written by -MD or -MMD.
+    :param text: the content of the depfile
+    :param directory: working directory of the compiler, which relative paths are based on
+    :return: the absolute paths of all dependencies
+    """
+    dependencies = set()
+    for token in DEPFILE_TOKEN_RE.findall(text):
+        if not token.endswith(':'):
+            path = DEPFILE_ESCAPE_RE.sub(lambda m: m[1] or m[2], token)
+            dependencies.add(os.path.normpath(os.path.join(directory, path)))
+    return dependencies
+
+
+def source_files(command: CompileCommand) -> Set[str]:
+    """
+    :param command: the compile command
+    :return: the absolute paths of the source files passed to the compiler
+    """
+    return {os.path.normpath(os.path.join(command.directory, arg)) for arg in command.arguments[1:]
+            if os.path.splitext(arg)[1] in SOURCE_FILE_EXTENSIONS}
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PollingWatcher:
+    """
+    Detects changed files by their modification time and size.
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        """
+        :param interval: seconds between two checks
+        """
+        self._interval = interval
+        self._stats = {}
+
+    def watch(self, files: Iterable[str]):
+        """
+        Replaces the watched files. Changes of files watched before are still reported by the next wait.
+        :param files: absolute paths of the files
+        """
+        self._stats = {file: self._stats[file] if file in self._stats else _stat(file) for file in files}
+
+    def wait(self) -> Set[str]:
+        """
+        Blocks until watched files have changed.
+        :return: the changed files
+        """
+        while True:
+            time.sleep(self._interval)
+            changed = set()
+            for file, stat in self._stats.items():
+                new_stat = _stat(file)
+                if new_stat != stat:
+                    self._stats[file] = new_stat
+                    changed.add(file)
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changed files by inotify events of their directories (Linux only).
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._files = set()
+        self._directories = {}
+        self._watch_descriptors = {}
+
+    def watch(self, files: Iterable[str]):
+        """
+        Replaces the watched files. Changes of files watched before are still reported by the next wait.
+        :param files: absolute paths of the files
+        """
+        self._files = set(files)
+        directories = {os.path.dirname(file) for file in self._files}
+        for directory in set(self._directories) - directories:
+            wd = self._directories.pop(directory)
+            del self._watch_descriptors[wd]
+            self._rm_watch(self._fd, wd)
+        for directory in directories - set(self._directories):
+            wd = self._add_watch(self._fd, os.fsencode(directory), WATCH_EVENTS)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOENT:
+                    # Directories which don't exist (yet) can't be watched.
+                    continue
+                raise OSError(error, 'Cannot watch {}: {}'.format(directory, os.strerror(error)))
+            self._directories[directory] = wd
+            self._watch_descriptors[wd] = directory
+
+    def wait(self) -> Set[str]:
+        """
+        Blocks until watched files have changed.
+        :return: the changed files
+        """
+        changed = set()
+        while not changed:
+            changed = self._read_events()
+        while select.select([self._fd], [], [], DEBOUNCE_DELAY)[0]:
+            changed |= self._read_events()
+        return changed
+
+    def _read_events(self) -> Set[str]:
+        data = os.read(self._fd, INOTIFY_BUFFER_SIZE)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # Events have been lost.
+                changed |= self._files
+            elif wd in self._watch_descriptors:
+                path = os.path.join(self._watch_descriptors[wd], name)
+                if path in self._files:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_watcher():
+    """
+    :return: an inotify watcher on Linux, otherwise a polling watcher
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher()
+
+
+def output_lines(statements: List) -> List[str]:
+    """
+    :param statements: the parsed statements
+    :return: the lines of the messages without time points, which are compared between runs
+    """
+    return ''.join(statement.serialize()[0] for statement in statements).splitlines()
+
+
+def diff_output(previous: List[str], current: List[str], colored: bool) -> List[str]:
+    """
+    :param previous: the output lines of the previous run
+    :param current: the output lines of this run
+    :param colored: if added and removed lines should be colored
+    :return: the lines of a unified diff, empty if the output is unchanged
+    """
+    lines = list(difflib.unified_diff(previous, current, 'previous run', 'this run', lineterm=''))
+    if colored:
+        colors = {'+': '\033[32m', '-': '\033[31m', '@': '\033[36m'}
+        lines = [line if line.startswith(('+++', '---')) or line[:1] not in colors
+                 else '{}{}\033[0m'.format(colors[line[:1]], line) for line in lines]
+    return lines
+
+
+def watched_commands(options) -> List[CompileCommand]:
+    """
+    :param options: the command line options
+    :return: the compile commands of the translation units to watch
+    """
+    if options.compile_commands:
+        commands = [command._replace(arguments=add_required_flags(command.arguments))
+                    for command in load_compile_commands(options.compile_commands, options.filter)]
+    else:
+        directory = os.getcwd()
+        command = CompileCommand(directory, ' '.join(options.prog_and_args), options.prog_and_args)
+        sources = sorted(source_files(command))
+        commands = [command._replace(file=sources[0]) if len(sources) == 1 else command]
+    if not options.no_inject_flags:
+        commands = [command._replace(arguments=inject_flags(command.arguments)) for command in commands]
+    return commands
+
+
+def run_watched_command(command: CompileCommand, depfile: str, type_prettifier: TypePrettifier,
+                        print_compiler_log: bool) -> Tuple[List, int, Optional[str], Optional[Set[str]]]:
+    """
+    Compiles one translation unit and collects its dependencies.
+    :param command: the compile command
+    :param depfile: absolute path the compiler writes the dependencies to
+    :param type_prettifier: the type prettifier
+    :param print_compiler_log: flag to enable printing unparsed compiler log
+    :return: the parsed statements, the return code of the compiler, the parse error if any and the dependencies or
+             None if the compiler wrote no depfile
+    """
+    if os.path.exists(depfile):
+        os.remove(depfile)
+    try:
+        # Relative to the working directory of the compiler, which is all a compiler run in a container may see.
+        depfile_argument = os.path.relpath(depfile, command.directory)
+    except ValueError:
+        # Another drive on Windows.
+        depfile_argument = depfile
+    # The last -MF takes precedence over the one of the command.
+    statements, return_code, error = parse_command(command.arguments + ['-MMD', '-MF', depfile_argument],
+                                                   command.directory, type_prettifier, print_compiler_log)
+    try:
+        with open(depfile) as f:
+            dependencies = parse_depfile(f.read(), command.directory)
+    except OSError:
+        dependencies = None
+    return statements, return_code, error, dependencies
+
+
+def _print_watch_result(command: CompileCommand, statements: List, previous: Optional[List[str]], options):
+    if options.format == 'jsonl':
+        # JSON records of each run are written in full, consumers compare them themselves.
+        for statement in statements:
+            print_statement(statement, options, flush=True, file=command.file)
+        return
+
+    print('==> {} <=='.format(command.file), flush=True)
+    if previous is None:
+        for statement in statements:
+            print_statement(statement, options, flush=True)
+        return
+    lines = diff_output(previous, output_lines(statements), not options.no_color)
+    print('\n'.join(lines) if lines else 'Output unchanged.', flush=True)
+
+
+def watch(options, watcher=None, depfile_dir: Optional[str] = None):
+    """
+    Runs the program or the compilation database given by the command line options, then re-runs the translation
+    units whose dependencies changed and prints the difference to their previous output until interrupted.
+    :param options: the command line options
+    :param watcher: the watcher of the dependencies, defaults to `create_watcher`
+    :param depfile_dir: parent directory of the temporary directory of the depfiles, defaults to the one of the system
+    """
+    commands = watched_commands(options)
+    type_prettifier = TypePrettifier(options.remove, options.capture_remove, options.combine_removes)
+    if watcher is None:
+        watcher = create_watcher()
+
+    outputs = {}
+    dependencies = {i: source_files(command) for i, command in enumerate(commands)}
+    with tempfile.TemporaryDirectory(dir=depfile_dir) as depfile_directory:
+        depfiles = [os.path.join(depfile_directory, '{}.d'.format(i)) for i in range(len(commands))]
+        indices = list(range(len(commands)))
+        try:
+            while True:
+                # Armed before the compile, so files saved while it runs are reported by the next wait.
+                watcher.watch(set().union(*dependencies.values()))
+                args = ([commands[i] for i in indices], [depfiles[i] for i in indices], repeat(type_prettifier),
+                        repeat(not options.hide_compiler_log))
+                if len(indices) > 1:
+                    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+                        results = list(executor.map(run_watched_command, *args))
+                else:
+                    results = list(map(run_watched_command, *args))
+
+                for i, (statements, _, error, tu_dependencies) in zip(indices, results):
+                    if tu_dependencies is not None:
+                        dependencies[i] = tu_dependencies | source_files(commands[i])
+                    if error:
+                        statements.append(CompilerStatement('{}\n'.format(error)))
+                    _print_watch_result(commands[i], statements, outputs.get(i), options)
+                    outputs[i] = output_lines(statements)
+
+                files = set().union(*dependencies.values())
+                watcher.watch(files)
+                print('Watching {} files for changes, press Ctrl+C to stop.'.format(len(files)), file=sys.stderr,
+                      flush=True)
+                while True:
+                    changed = watcher.wait()
+                    indices = [i for i in range(len(commands)) if dependencies[i] & changed]
+                    if indices:
+                        break
+                if options.format == 'text':
+                    print('Changed: {}'.format(', '.join(sorted(os.path.relpath(file) for file in changed))),
+                          flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
@@ -0,0 +1,220 @@
+"""
+Benchmarks for parsing compiler logs.
+
+Run from the project root with:
+
+    python -m tests.benchmark
+
+The synthetic scenarios do not need a compiler. Scenarios based on real GCC logs are added if g++ is available.
+"""
+import argparse
+import multiprocessing
+import shutil
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from compile_time_printer.ctp import CTP, REDUCED_DIAGNOSTICS_FLAGS, PrintStatement, TypePrettifier
+from compile_time_printer.json_diagnostics import JsonCTP
+from tests.synthetic_log import generate_log
+
+# Source generating ordinary warnings with template backtraces unrelated to CTP.
+NOISE_SOURCE = """
+template<int N>
+struct Recurse {
+    static int value(int x) {
+        int unused = x;
+        return Recurse<N - 1>::value(x) + (x == -1u);
+    }
+};
+
+template<>
+struct Recurse<0> {
+    static int value(int x) {
+        return x;
+    }
+};
+
+int main() {
+    return Recurse<20>::value(1);
+}
+"""
+
+# Source printing long strings to compare the protocol versions of the C++ header.
+STRING_SOURCE = """
+#include <ctp/ctp.hpp>
+
+template<int N>
+constexpr auto test() {
+    for (int i = 0; i < N; ++i) {
+        ctp::print(ctp::stdout, "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+                                "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis "
+                                "nostrud", i);
+    }
+    return 0;
+}
+
+constexpr auto i = test<20>();
+"""
+
+# Source printing a large lookup table to compare the protocol versions of the C++ header.
+ARRAY_SOURCE = """
+#include <ctp/ctp.hpp>
+
+constexpr auto table() {
+    std::array<int, 10000> t{};
+    for (int i = 0; i < 10000; ++i) {
+        t[i] = i < 5000 ? i % 100 - 50 : 0;
+    }
+    return t;
+}
+
+constexpr auto i = ctp::print(table());
+"""
+
+
+def compile_data_file(file, flags=()):
+    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only', 'tests/data/' + file, *flags]
+    prog = subprocess.run(command, stderr=subprocess.PIPE)
+    return prog.stderr.decode('utf8').splitlines(keepends=True)
+
+
+def compile_noise():
+    command = ['g++', '-std=c++17', '-Wall', '-Wextra', '-fsyntax-only', '-xc++', '-']
+    prog = subprocess.run(command, input=NOISE_SOURCE.encode('utf8'), stderr=subprocess.PIPE)
+    return prog.stderr.decode('utf8').splitlines(keepends=True)
+
+
+def nested_tuple(depth):
+    value = (depth, 'leaf')
+    for i in range(depth):
+        value = (i, value, [i, -i])
+    return value
+
+
+def synthetic_scenarios(scale):
+    """
+    Returns the name and the log of each synthetic scenario.
+    :param scale: factor for the size of the logs
+    """
+    def n(count):
+        return max(1, int(count * scale))
+
+    yield 'print statements', generate_log([[i, -i, 'value', 1.5] for i in range(n(10000))])
+    yield 'deep tuple/array nesting', generate_log([[nested_tuple(20)] for _ in range(n(100))])
+    yield 'long strings', generate_log([['x' * n(10000) + 'ü'] for _ in range(20)])
+    yield 'huge ctp::view array', generate_log([[list(range(n(100000)))]])
+    yield 'huge ctp::view array, protocol version 1', generate_log([[list(range(n(100000)))]], protocol_version=1)
+    yield 'interleaved noise', generate_log([[i, 'value'] for i in range(n(1000))], noise_per_statement=200)
+
+
+def compiler_scenarios(scale):
+    """
+    Returns the name, the log and the parser of each scenario based on real GCC logs.
+    :param scale: factor for the size of the logs
+    """
+    log = compile_data_file('fibonacci_with_noise.cpp')
+    noise = compile_noise()
+
+    json_log = compile_data_file('fibonacci_with_noise.cpp', ['-fdiagnostics-format=json'])
+    repeat = max(1, int(1000 * scale))
+
+    yield 'fibonacci_with_noise.cpp x{}'.format(repeat), log * repeat, CTP
+    yield 'fibonacci_with_noise.cpp and warnings x{}'.format(repeat), (log + noise) * repeat, CTP
+    yield 'fibonacci_with_noise.cpp, JSON diagnostics x{}'.format(repeat), json_log * repeat, JsonCTP
+
+
+def compile_benchmark(name, source, flags):
+    """
+    Prints the wall time of GCC and the size of the compiler log.
+    """
+    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only', '-xc++', '-'] + flags
+    start = time.perf_counter()
+    prog = subprocess.run(command, input=source.encode('utf8'), stderr=subprocess.PIPE)
+    duration = time.perf_counter() - start
+    print('{}: g++ in {:.3f}s, {} lines, {:.1f} KiB compiler log'.format(
+        name, duration, len(prog.stderr.splitlines()), len(prog.stderr) / 2 ** 10), flush=True)
+
+
+def parse(log, print_compiler_log, parser_class):
+    ctp = parser_class(TypePrettifier([], []), print_compiler_log)
+    ctp.parse_error_log(iter(log))
+    return sum(1 for printer in ctp.printers if isinstance(printer, PrintStatement))
+
+
+def benchmark(name, log, print_compiler_log=True, memory=True, parser_class=CTP):
+    """
+    Prints lines/s and print statements/s of parsing the log and the peak memory in a second, traced run.
+    """
+    start = time.perf_counter()
+    statements = parse(log, print_compiler_log, parser_class)
+    duration = time.perf_counter() - start
+
+    result = '{}: {} lines, {} statements in {:.3f}s ({:.0f} lines/s, {:.0f} statements/s)'.format(
+        name, len(log), statements, duration, len(log) / duration, statements / duration)
+    if memory:
+        # Tracing slows down parsing, so it is measured separately.
+        tracemalloc.start()
+        parse(log, print_compiler_log, parser_class)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result += ', peak memory {:.1f} MiB'.format(peak / 2 ** 20)
+    print(result, flush=True)
+
+
+def retained_statements(count):
+    """
+    Parses a log of many print statements keeping all of them, like --timeline and --cache do.
+    Runs in a fresh process, so the peak RSS isn't affected by other scenarios (ru_maxrss is in KiB on Linux).
+    :return: the peak RSS after generating the log and after parsing it
+    """
+    import resource
+    log = generate_log([[i, -i, 'value', 1.5] for i in range(count)])
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    parse(log, False, CTP)
+    return before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rss_benchmark(scale):
+    """
+    Prints the peak RSS of parsing a large synthetic log.
+    """
+    count = max(1, int(200000 * scale))
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        before, after = executor.submit(retained_statements, count).result()
+    print('{} retained print statements: peak RSS {:.1f} MiB, {:.1f} MiB for parsing ({:.0f} bytes/statement)'.format(
+        count, after / 2 ** 10, (after - before) / 2 ** 10, (after - before) * 2 ** 10 / count), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for parsing compiler logs.')
+    parser.add_argument('--scale', type=float, default=1.0, help='factor for the size of the logs')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring the peak memory')
+    parser.add_argument('--no-compiler', action='store_true', help='skip the scenarios based on real GCC logs')
+    parser.add_argument('--no-rss', action='store_true', help='skip measuring the peak RSS of a large synthetic log')
+    options = parser.parse_args()
+
+    scenarios = [(name, log, CTP) for name, log in synthetic_scenarios(options.scale)]
+    if not options.no_compiler and shutil.which('g++'):
+        scenarios += compiler_scenarios(options.scale)
+
+    if not options.no_rss:
+        rss_benchmark(options.scale)
+
+    for name, log, parser_class in scenarios:
+        benchmark(name, log, memory=not options.no_memory, parser_class=parser_class)
+        benchmark(name + ' (hide compiler log)', log, print_compiler_log=False, memory=not options.no_memory,
+                  parser_class=parser_class)
+
+    if not options.no_compiler and shutil.which('g++'):
+        for protocol_version in [1, 2]:
+            compile_benchmark('long strings, protocol version {}'.format(protocol_version), STRING_SOURCE,
+                              ['-DCTP_PROTOCOL_VERSION={}'.format(protocol_version)])
+            compile_benchmark('integer table, protocol version {}'.format(protocol_version), ARRAY_SOURCE,
+                              ['-DCTP_PROTOCOL_VERSION={}'.format(protocol_version)])
+        compile_benchmark('long strings, reduced diagnostics', STRING_SOURCE, REDUCED_DIAGNOSTICS_FLAGS)
+
+
+if __name__ == '__main__':
+    main()
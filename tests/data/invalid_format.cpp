@@ -0,0 +1,5 @@
+#include <ctp/ctp.hpp>
+
+constexpr auto a = ctp::print("Before");
+constexpr auto b = ctp::printf("{} {}\n", 1);
+constexpr auto c = ctp::print("After");
@@ -0,0 +1,228 @@
+"""
+Generator for synthetic GCC logs, so the parser can be exercised without a compiler.
+
+The generated lines mimic the output of GCC for ``ctp::print`` calls: the instantiation context, the shift warning
+carrying a value and the trailing notes of each ``CTP_INTERNAL_PRINT``.
+"""
+import math
+from typing import Iterator, List, Tuple
+
+from compile_time_printer.ctp import PROTOCOL_VERSION, Indicator
+
+SOURCE_FILE = 'src/synthetic.cpp'
+HEADER_FILE = 'include/ctp/ctp.hpp'
+
+# Fractions are sent as integers with 18 decimal places.
+FRACTION_FACTOR = 10 ** 18
+
+# Characters packed into one value since protocol version 2.
+PACKED_STRING_SIZE = 16
+
+# Layout of packed integers since protocol version 2.
+PACKED_INTEGERS_HEADER_BITS = 16
+PACKED_INTEGERS_PAYLOAD_BITS = 128 - PACKED_INTEGERS_HEADER_BITS
+RUN_LENGTH_MIN = 4
+
+CONTEXT = [
+    "{src}:{line}:20:   in 'constexpr' expansion of 'f()'\n",
+    "{src}:{line}:30:   in 'constexpr' expansion of 'ctp::print<{types}>({types})'\n",
+    HEADER_FILE + ":402:29:   in 'constexpr' expansion of 'ctp::detail::print<false, {types}>((* & args#0))'\n",
+]
+START_INDICATOR = (HEADER_FILE + ":381:31:   in 'constexpr' expansion of "
+                   "'ctp::detail::print_start_indicator<false, {types}>(one, (* & args#0))'\n")
+END_INDICATOR = (HEADER_FILE + ":387:15:   in 'constexpr' expansion of "
+                 "'ctp::detail::print_end_indicator<false, {types}>(one, (* & args#0))'\n")
+PRINT_VALUE = (HEADER_FILE + ":371:14:   in 'constexpr' expansion of 'ctp::detail::print_value<{type}, "
+               "const separator_t&, {types}>((* & one), (* & args#0), ctp::detail::separator, 0, 0, 1)'\n")
+SHIFT_WARNING = [
+    HEADER_FILE + ":193:46: warning: right operand of shift expression '({number} << {indicator})' is greater "
+                  'than or equal to the precision 128 of the left operand [-fpermissive]\n',
+    '  193 |         { [[maybe_unused]] auto unused = (x) << static_cast<uint32_t>(y); }\n',
+    '      |                                          ~~~~^~~~~~~~~~~~~~~~~~~~~~~~~~~\n',
+    HEADER_FILE + ":203:25: note: in expansion of macro 'CTP_INTERNAL_PRINT'\n",
+    '  203 |                         CTP_INTERNAL_PRINT(value, Indicator::Value);\n',
+    '      |                         ^~~~~~~~~~~~~~~~~~\n',
+]
+PROTOCOL_VERSION_LOG = [
+    'In file included from {src}:1:\n',
+    HEADER_FILE + ": In instantiation of 'constexpr auto ctp::detail::print_protocol_version() "
+                  "[with int Version = {version}]':\n",
+    HEADER_FILE + ':358:91:   required from here\n',
+    HEADER_FILE + ":352:13: warning: unused variable 'version' [-Wunused-variable]\n",
+    '  352 |         int version = Version;\n',
+    '      |             ^~~~~~~\n',
+]
+NOISE = [
+    "{src}: In instantiation of 'int Recurse<N>::value(int) [with int N = {line}]':\n",
+    '{src}:{line}:31:   required from here\n',
+    "{src}:{line}:13: warning: unused variable 'unused' [-Wunused-variable]\n",
+    '  {line} |         int unused = x;\n',
+    '      |             ^~~~~~\n',
+]
+
+
+def type_name(value) -> str:
+    """
+    Returns the C++ type GCC would print for the value.
+    """
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'long int'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, str):
+        return 'const char*'
+    if isinstance(value, tuple):
+        return 'std::tuple<{}>'.format(', '.join(type_name(v) for v in value))
+    if isinstance(value, list):
+        return 'ctp::view<{}>'.format(type_name(value[0]) if value else 'int')
+    raise TypeError('Unsupported value: {!r}'.format(value))
+
+
+def encode_value(value, types: Tuple[str, ...] = (),
+                 protocol_version: int = PROTOCOL_VERSION) -> Iterator[Tuple[Tuple[str, ...], int, Indicator]]:
+    """
+    Encodes the value like the C++ side does.
+    :param value: a bool, int, float, str, tuple or list (printed as ``ctp::view``)
+    :param types: the types of the enclosing values
+    :param protocol_version: the protocol version of the C++ side
+    :return: the types of all print_value instantiations, the number and the indicator of each value
+    """
+    types = types + (type_name(value),)
+    if isinstance(value, bool):
+        yield types, int(value), Indicator.PositiveInteger
+    elif isinstance(value, int):
+        yield types, abs(value), Indicator.PositiveInteger if value >= 0 else Indicator.NegativeInteger
+    elif isinstance(value, float):
+        if math.isnan(value):
+            yield types, 1, Indicator.NaNFloat
+        elif math.isinf(value):
+            yield types, 1, Indicator.PositiveInfinityFloat if value > 0 else Indicator.NegativeInfinityFloat
+        else:
+            integral = int(abs(value))
+            yield types, integral, Indicator.PositiveFloat if value >= 0 else Indicator.NegativeFloat
+            yield types, round((abs(value) - integral) * FRACTION_FACTOR), Indicator.FractionFloat
+    elif isinstance(value, str) and protocol_version >= 2:
+        data = value.encode('utf8')
+        yield types, len(data), Indicator.StringBegin
+        for i in range(0, len(data), PACKED_STRING_SIZE):
+            yield types, int.from_bytes(data[i:i + PACKED_STRING_SIZE], 'little'), Indicator.PackedString
+        yield types, 1, Indicator.StringEnd
+    elif isinstance(value, str):
+        yield types, 1, Indicator.StringBegin
+        char_types = types + ('char',)
+        for byte in value.encode('utf8'):
+            # Characters are signed, the upper half of a byte is sent negative.
+            if byte < 128:
+                yield char_types, byte, Indicator.PositiveInteger
+            else:
+                yield char_types, 256 - byte, Indicator.NegativeInteger
+        yield types, 1, Indicator.StringEnd
+    elif isinstance(value, list) and value and protocol_version >= 2 and all(
+            isinstance(v, int) and not isinstance(v, bool) for v in value):
+        yield types, 1, Indicator.ArrayBegin
+        for number, indicator in encode_integers(value):
+            yield types, number, indicator
+        yield types, 1, Indicator.ArrayEnd
+    else:
+        begin, end = (Indicator.TupleBegin, Indicator.TupleEnd) if isinstance(value, tuple) else (
+            Indicator.ArrayBegin, Indicator.ArrayEnd)
+        yield types, 1, begin
+        for v in value:
+            yield from encode_value(v, types, protocol_version)
+        yield types, 1, end
+
+
+def encode_integers(values: List[int], is_signed: bool = True) -> Iterator[Tuple[int, Indicator]]:
+    """
+    Packs the integers of an array like the C++ side does since protocol version 2.
+    :param values: the integers
+    :param is_signed: flag if the integer type is signed, the type of ints is ``long int``
+    :return: the number and the indicator of each value
+    """
+    zigzag = [(-2 * v - 1 if v < 0 else 2 * v) if is_signed else v for v in values]
+    pack = []
+    width = 1
+    i = 0
+    while i < len(zigzag) or pack:
+        run = 0
+        v = 0
+        if i < len(zigzag):
+            v = zigzag[i]
+            while i + run < len(zigzag) and zigzag[i + run] == v:
+                run += 1
+        is_run = run >= RUN_LENGTH_MIN
+        new_width = max(width, v.bit_length())
+        if pack and (i == len(zigzag) or is_run or (len(pack) + 1) * new_width > PACKED_INTEGERS_PAYLOAD_BITS):
+            number = len(pack) | width << 8 | is_signed << 15
+            for j, p in enumerate(pack):
+                number |= p << (PACKED_INTEGERS_HEADER_BITS + j * width)
+            yield number, Indicator.PackedIntegers
+            pack = []
+            width = 1
+        elif is_run:
+            yield run | is_signed << 63 | v << 64, Indicator.RunLength
+            i += run
+        else:
+            pack.append(v)
+            width = new_width
+            i += 1
+
+
+def shift_warning(number: int, indicator: Indicator) -> List[str]:
+    # GCC prints values exceeding 64 bits in hexadecimal.
+    number = hex(number) if number >= 2 ** 64 else number
+    return [SHIFT_WARNING[0].format(number=number, indicator=int(indicator))] + SHIFT_WARNING[1:]
+
+
+def protocol_version_log(version: int = PROTOCOL_VERSION) -> List[str]:
+    return [line.format(src=SOURCE_FILE, version=version) for line in PROTOCOL_VERSION_LOG]
+
+
+def print_statement_log(args: list, line: int = 1, start: Indicator = Indicator.StartErr,
+                        protocol_version: int = PROTOCOL_VERSION) -> List[str]:
+    """
+    Generates the log of a ``ctp::print`` call.
+    :param args: the arguments of the print call
+    :param line: the line of the print call in the source file
+    :param start: the start indicator selecting the output stream and format mode
+    :param protocol_version: the protocol version of the C++ side
+    :return: the lines of the log
+    """
+    types = ', '.join(type_name(arg) for arg in args)
+    context = [c.format(src=SOURCE_FILE, line=line, types=types) for c in CONTEXT]
+
+    log = context + [START_INDICATOR.format(types=types)] + shift_warning(1, start)
+    for arg in args:
+        for value_types, number, indicator in encode_value(arg, protocol_version=protocol_version):
+            log += context
+            log += [PRINT_VALUE.format(type=t, types=types) for t in value_types]
+            log += shift_warning(number, indicator)
+    return log + context + [END_INDICATOR.format(types=types)] + shift_warning(1, Indicator.End)
+
+
+def noise_log(count: int, line: int = 1) -> List[str]:
+    """
+    Generates ordinary warnings unrelated to CTP.
+    :param count: number of warnings
+    :param line: the line of the first warning
+    :return: the lines of the log
+    """
+    return [n.format(src=SOURCE_FILE, line=line + i) for i in range(count) for n in NOISE]
+
+
+def generate_log(statements: List[list], noise_per_statement: int = 0,
+                 protocol_version: int = PROTOCOL_VERSION) -> List[str]:
+    """
+    Generates the log of a translation unit printing the given statements.
+    :param statements: the arguments of each print call
+    :param noise_per_statement: number of unrelated warnings in front of each print call
+    :param protocol_version: the protocol version of the C++ side
+    :return: the lines of the log
+    """
+    log = protocol_version_log(protocol_version)
+    for i, args in enumerate(statements):
+        log += noise_log(noise_per_statement, i * noise_per_statement + 1)
+        log += print_statement_log(args, i + 1, protocol_version=protocol_version)
+    return log
@@ -1,13 +1,25 @@
+import gzip
 import io
+import json
 import os
 import re
 import subprocess
 import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
 from contextlib import contextmanager, redirect_stdout, redirect_stderr
 
 import pytest
 
-from compile_time_printer.ctp import main
+from compile_time_printer.compile_commands import add_required_flags, parse_command
+from compile_time_printer.ctp import TypePrettifier, inject_flags, main, parse_args
+from compile_time_printer.json_diagnostics import INTEGER_WARNING
+from compile_time_printer.log_file import read_log_file
+from compile_time_printer.server import CompilerPool, create_server
+from compile_time_printer.watch import PollingWatcher, parse_depfile, watch
+from tests.test_parser import requires_json_diagnostics
 
 
 def test_get_compiler_version(capsys):
@@ -40,6 +52,17 @@ def cwd(path):
         os.chdir(oldpwd)
 
 
+@contextmanager
+def source_folder():
+    """
+    Temporary directory for generated sources inside the working directory, since the g++ wrapper of the CI
+    (tests/g++) only mounts the working directory into its container.
+    :return: the path relative to the working directory
+    """
+    with tempfile.TemporaryDirectory(dir='tests') as folder:
+        yield os.path.relpath(folder)
+
+
 def test_dump_files():
     try:
         os.symlink('../../include', 'src/compile_time_printer/include')
@@ -62,6 +85,17 @@ def test_no_args():
     assert err.getvalue() == 'No CTP output found.\n'
 
 
+def test_invalid_utf8():
+    log = b'a.cpp:1:1: warning: \xff\xfe in type name\n\xe2\x82\xac'
+    p = subprocess.run(['python', 'src/compile_time_printer/ctp.py'], input=log, stderr=subprocess.PIPE)
+    assert p.stderr == b'No CTP output found.\n' + log
+
+    err = io.StringIO()
+    with redirect_stderr(err):
+        main(['--', 'python', '-c', 'import sys; sys.stderr.buffer.write(b"\\xff\\n")'])
+    assert err.getvalue() == 'No CTP output found.\n\udcff\n'
+
+
 def run_main(file, params=None, other=None, capture=True):
     if params is None:
         params = []
@@ -111,6 +145,10 @@ def test_example_user_defined_type_with_type_prettifier():
     assert out == 'Print type FooBa. .i = 1, .i = 2.\n'
     assert not err
 
+    out, err = run_main('user_defined_type.cpp', ['-r', '&', '-r', 'Foo', '--combine-removes'])
+    assert out == 'Print type Bar. .i = 1, .i = 2.\n'
+    assert not err
+
 
 def test_example_output_stream():
     out, err = run_main('output_stream.cpp')
@@ -122,6 +160,135 @@ def test_example_output_stream():
     assert err == '1\nLog 1\n'
 
 
+def test_buffer_output():
+    out, err = run_main('output_stream.cpp', ['--buffer-output', '--no-color'])
+    assert out == '1\n1\nLog 1\n'
+    assert err == '1\nLog 1\n'
+
+
+def test_demultiplex():
+    out, err = run_main('output_stream.cpp', ['--demultiplex', '--no-color'])
+    assert out == '1\n1\nLog 1\n'
+    assert err == '1\nLog 1\n'
+
+
+def test_format_jsonl():
+    out, err = run_main('value_stack.cpp', ['--format', 'jsonl', '--no-color'])
+    records = [json.loads(line) for line in out.splitlines()]
+    assert all(isinstance(record.pop('time_point'), float) for record in records)
+    assert records == [
+        {'stream': 'stdout', 'message': '[0, 0, 0]\n', 'args': [[0, 0, 0]], 'compiler_log': False},
+        {'stream': 'stdout', 'message': 'push 2\n', 'args': ['push', 2], 'compiler_log': False},
+        {'stream': 'stdout', 'message': 'push 5\n', 'args': ['push', 5], 'compiler_log': False},
+        {'stream': 'stdout', 'message': 'push 7\n', 'args': ['push', 7], 'compiler_log': False},
+        {'stream': 'stdout', 'message': '[2, 5, 7]\n', 'args': [[2, 5, 7]], 'compiler_log': False},
+        {'stream': 'stderr', 'message': 'Stack overflow!\n', 'args': ['Stack overflow!'], 'compiler_log': False},
+    ]
+    assert not err
+
+    out = io.StringIO()
+    with redirect_stdout(out):
+        main(['--format', 'jsonl', '--', 'cat', '/dev/null'])
+    assert json.loads(out.getvalue()) == {'stream': 'stderr', 'message': 'No CTP output found.\n', 'args': None,
+                                          'time_point': None, 'compiler_log': True}
+
+
+def test_format_jsonl_program_stdout(capfd):
+    # The stdout of the program (e.g. of make) must not mix with the JSON records.
+    main(['--format', 'jsonl', '--', 'sh', '-c', 'echo building; echo warning >&2'])
+    out, err = capfd.readouterr()
+    assert sorted(json.loads(line)['message'] for line in out.splitlines()) == ['No CTP output found.\n', 'warning\n']
+    assert err == 'building\n'
+
+
+def test_timeline():
+    out, err = run_main('fibonacci.cpp', ['--timeline'])
+    assert out == '1 + 1 + 1 + 1 + 1 + 1 + 1 + 1 + 0 = 8\n'
+    lines = err.splitlines()
+    assert lines[0] == 'Timeline:'
+    assert len([line for line in lines if re.match(r'  +\d+\.\d{3}s +\+\d+\.\d{3}s  ', line)]) == 9
+    assert lines[lines.index('Gaps:') + 1].strip().startswith('< 1ms')
+    assert sum(int(line.split()[-2 if line.endswith('#') else -1]) for line in lines[lines.index('Gaps:') + 1:-1]) == 9
+    assert lines[-1].startswith('Largest gap: ')
+
+    # Run as script, the lazily imported timeline module has to get the statements of the package module.
+    p = subprocess.run(['python', 'src/compile_time_printer/ctp.py', '--timeline', '--', 'g++', '-Iinclude',
+                        '-fsyntax-only', '-std=c++17', '-fpermissive', 'tests/data/fibonacci.cpp'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    assert p.stdout.decode('utf8') == out
+    assert p.stderr.decode('utf8').splitlines()[-1].startswith('Largest gap: ')
+
+
+def test_save_and_replay_log():
+    with tempfile.TemporaryDirectory() as folder:
+        for name in ['ctp.log', 'ctp.log.gz']:
+            path = os.path.join(folder, name)
+            out, err = run_main('user_defined_type.cpp', ['--save-log', path, '-r', '&'])
+            assert out == 'Print type FooBar. .i = 1, .i = 2.\n'
+
+            out = io.StringIO()
+            err = io.StringIO()
+            with redirect_stdout(out), redirect_stderr(err):
+                main(['--from-log', path, '-cr', '(.+Ba)r&'])
+            assert out.getvalue() == 'Print type FooBa. .i = 1, .i = 2.\n'
+            assert not err.getvalue()
+
+            # Lines split across chunks are joined again.
+            with (gzip.open if name.endswith('.gz') else open)(path, 'rb') as f:
+                lines = f.read().decode('utf8').splitlines(keepends=True)
+            assert list(read_log_file(path, chunk_size=7)) == lines
+
+        path = os.path.join(folder, 'empty.log')
+        open(path, 'w').close()
+        err = io.StringIO()
+        with redirect_stderr(err):
+            main(['--from-log', path])
+        assert err.getvalue() == 'No CTP output found.\n'
+
+    for args in [['--from-log', 'ctp.log', '--', 'g++'], ['--from-log', 'ctp.log', '--time-point'],
+                 ['--from-log', 'ctp.log', '--timeline']]:
+        with pytest.raises(SystemExit):
+            main(args)
+
+
+def test_cache():
+    with tempfile.TemporaryDirectory() as folder:
+        out, err = run_main('user_defined_type.cpp', ['--cache', '--cache-dir', folder])
+        assert out == 'Print type FooBar&. .i = 1, .i = 2.\n'
+        entries = os.listdir(folder)
+        assert len(entries) == 1
+
+        # Statements are replayed from the cache entry.
+        path = os.path.join(folder, entries[0])
+        with open(path) as f:
+            entry = json.load(f)
+        entry['statements'][0]['message'] = 'Cached.\n'
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+        out, err = run_main('user_defined_type.cpp', ['--cache', '--cache-dir', folder])
+        assert out == 'Cached.\n'
+
+        # Other parser options are a cache miss.
+        out, err = run_main('user_defined_type.cpp', ['--cache', '--cache-dir', folder, '-r', '&'])
+        assert out == 'Print type FooBar. .i = 1, .i = 2.\n'
+        assert len(os.listdir(folder)) == 2
+
+        # Least recently used entries are evicted.
+        run_main('user_defined_type.cpp', ['--cache', '--cache-dir', folder, '--cache-size', '0', '-r', 'Foo'])
+        assert os.listdir(folder) == []
+
+    for args in [['--cache'], ['--cache', '--', 'make'], ['--cache', '--', 'g++', '-fsyntax-only', '-xc++', '-']]:
+        with pytest.raises(SystemExit):
+            main(args)
+    # A cache hit doesn't compile, so no outputs would be written.
+    for command in [['g++', 'a.cpp'], ['g++', '-c', 'a.cpp', '-o', 'a.o'], ['g++', '-c', 'a.cpp', '-MMD'],
+                    ['g++', '-fsyntax-only', '-o', 'a.o', 'a.cpp'], ['g++', '-fsyntax-only', '-oa.o', 'a.cpp'],
+                    ['g++', '-fsyntax-only', '-MD', 'a.cpp'], ['g++', '-fsyntax-only', '-MFa.d', 'a.cpp']]:
+        with pytest.raises(SystemExit):
+            parse_args(['--cache', '--'] + command)
+    assert parse_args(['--cache', '--', 'g++', '-fsyntax-only', '-std=c++17', 'a.cpp']).cache
+
+
 def test_example_type_stack():
     out, err = run_main('type_stack.cpp')
     assert out == 'stack<>\npush int\npush double\npush char\nstack<char, double, int>\n'
@@ -134,6 +301,69 @@ def test_example_value_stack():
     assert err == 'Stack overflow!\n'
 
 
+@requires_json_diagnostics
+def test_json_diagnostics():
+    out, err = run_main('value_stack.cpp', ['--no-color'], other=['-fdiagnostics-format=json'])
+    assert out == '[0, 0, 0]\npush 2\npush 5\npush 7\n[2, 5, 7]\n'
+    assert err == INTEGER_WARNING + 'Stack overflow!\n'
+
+    with pytest.raises(SystemExit, match='Types cannot be printed with JSON diagnostics'):
+        run_main('type_stack.cpp', other=['-fdiagnostics-format=json'])
+
+    with pytest.raises(SystemExit):
+        run_main('value_stack.cpp', ['--demultiplex'], other=['-fdiagnostics-format=json'])
+
+
+def test_inject_flags():
+    reduce = ['-fno-diagnostics-show-caret', '-fno-diagnostics-color']
+    assert inject_flags(['g++', 'a.cpp']) == ['g++'] + reduce + ['-fpermissive', 'a.cpp']
+    assert inject_flags(['/usr/bin/x86_64-linux-gnu-g++-12', '-fno-permissive']) == [
+        '/usr/bin/x86_64-linux-gnu-g++-12'] + reduce + ['-fno-permissive']
+    assert inject_flags(['ccache', 'c++', '-fpermissive', '-fno-diagnostics-color']) == [
+        'ccache', 'c++', '-fno-diagnostics-show-caret', '-fpermissive', '-fno-diagnostics-color']
+    assert inject_flags(['clang++', 'a.cpp']) == ['clang++', 'a.cpp']
+    assert inject_flags(['make', '-j8']) == ['make', '-j8']
+    assert inject_flags(['ccache']) == ['ccache']
+
+    with source_folder() as folder:
+        source = os.path.join(folder, 'unused.cpp')
+        with open(source, 'w') as f:
+            f.write('#include <ctp/ctp.hpp>\nconstexpr int unused() { int i = 0; return 0; }\n'
+                    'constexpr auto i = ctp::print(1);\n')
+        command = ['--', 'g++', '-Iinclude', '-fsyntax-only', '-std=c++17', '-Wall', source]
+        for params, snippet in [(['--no-inject-flags'], True), ([], False)]:
+            out = io.StringIO()
+            err = io.StringIO()
+            with redirect_stdout(out), redirect_stderr(err):
+                main(params + command + (['-fpermissive'] if snippet else []))
+            assert out.getvalue() == '1\n'
+            assert 'unused variable' in err.getvalue()
+            assert ('constexpr int unused() {' in err.getvalue()) == snippet
+
+
+def test_max_statements():
+    with source_folder() as folder:
+        source = os.path.join(folder, 'runaway.cpp')
+        with open(source, 'w') as f:
+            f.write('#include <ctp/ctp.hpp>\n'
+                    'constexpr int f() { for (int i = 0; i < 100000; ++i) ctp::print("i =", i); return 0; }\n'
+                    'constexpr int x = f();\n')
+        command = ['--', 'g++', '-Iinclude', '-fsyntax-only', '-std=c++17', '-fconstexpr-loop-limit=1000000', source]
+        for params, notice in [(['--max-statements', '3'], 'more than 3 print statements'),
+                               (['--max-log-bytes', '100000', '--buffer-output'], 'compiler log exceeds 100000 bytes')]:
+            out = io.StringIO()
+            err = io.StringIO()
+            with pytest.raises(SystemExit) as e, redirect_stdout(out), redirect_stderr(err):
+                main(params + command)
+            assert e.value.code == 3
+            assert out.getvalue().startswith('i = 0\ni = 1\ni = 2\n')
+            assert err.getvalue().endswith('Output truncated: {}, the compiler has been stopped.\n'.format(notice))
+        assert out.getvalue().count('\n') < 100
+
+    with pytest.raises(SystemExit):
+        main(['--max-statements', '1', '--compile-commands', 'compile_commands.json'])
+
+
 def test_workarounds():
     out, err = run_main('workarounds.cpp')
     assert out == '1\n2\n3\n4\n1\n2\n3\n4\n'
@@ -145,6 +375,22 @@ def test_missing_permissive():
         run_main('value_stack.cpp', other=['-fno-permissive'])
 
 
+def test_invalid_format_string():
+    # Messages are formatted when printed, the error is reported like a parse error.
+    for params in [[], ['--buffer-output']]:
+        out = io.StringIO()
+        with redirect_stdout(out), pytest.raises(SystemExit) as e:
+            run_main('invalid_format.cpp', params, capture=False)
+        assert out.getvalue() == 'Before\n'
+        assert str(e.value) == 'Replacement index 1 out of range for positional args tuple'
+
+    command = ['g++', '-Iinclude', '-fsyntax-only', '-std=c++17', '-fpermissive', 'tests/data/invalid_format.cpp']
+    printers, return_code, error = parse_command(command, os.getcwd(), TypePrettifier([], []), False)
+    assert [printer.serialize() for printer in printers] == [('Before\n', False)]
+    assert return_code == 0
+    assert error == 'Replacement index 1 out of range for positional args tuple'
+
+
 def test_hide_compiler_log():
     # With compiler log.
     out = io.StringIO()
@@ -163,5 +409,268 @@ def test_hide_compiler_log():
     assert out.getvalue() == 'Print type FooBar&. .i = 1, .i = 2.\n'
 
 
+def test_compile_commands():
+    directory = os.getcwd()
+    entries = [
+        {'directory': directory, 'file': 'tests/data/user_defined_type.cpp',
+         'arguments': ['g++', '-Iinclude', '-std=c++17', '-c', 'tests/data/user_defined_type.cpp']},
+        {'directory': directory, 'file': 'tests/data/fibonacci_with_noise.cpp',
+         'command': 'g++ -Iinclude -std=c++17 -c tests/data/fibonacci_with_noise.cpp'},
+        {'directory': directory, 'file': 'tests/data/value_stack.cpp',
+         'command': 'g++ -Iinclude -std=c++17 -c tests/data/value_stack.cpp'},
+    ]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'compile_commands.json')
+        with open(path, 'w') as f:
+            json.dump(entries, f)
+
+        out = io.StringIO()
+        err = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            main(['--compile-commands', path, '-j', '2', '--no-color'])
+        assert out.getvalue() == ('==> {0}/tests/data/user_defined_type.cpp <==\n'
+                                  'Print type FooBar&. .i = 1, .i = 2.\n'
+                                  '==> {0}/tests/data/fibonacci_with_noise.cpp <==\n'
+                                  '1 + 1 + 1 + 1 + 1 + 1 + 1 + 1 + 0 = 8\n'
+                                  '==> {0}/tests/data/value_stack.cpp <==\n'
+                                  '[0, 0, 0]\npush 2\npush 5\npush 7\n[2, 5, 7]\n').format(directory)
+        assert err.getvalue() == 'Stack overflow!\n'
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(['--compile-commands', path, '--filter', '*/fib*.cpp'])
+        assert out.getvalue() == ('==> {}/tests/data/fibonacci_with_noise.cpp <==\n'
+                                  '1 + 1 + 1 + 1 + 1 + 1 + 1 + 1 + 0 = 8\n').format(directory)
+
+    with pytest.raises(SystemExit):
+        main(['--compile-commands', 'compile_commands.json', '--', 'g++'])
+
+
+def test_compile_commands_launcher():
+    assert add_required_flags(['g++', '-c', 'a.cpp']) == ['g++', '-fsyntax-only', '-fpermissive', '-c', 'a.cpp']
+    assert add_required_flags(['/usr/bin/ccache', 'distcc', 'g++', '-fpermissive', '-c', 'a.cpp']) == [
+        '/usr/bin/ccache', 'distcc', 'g++', '-fsyntax-only', '-fpermissive', '-c', 'a.cpp']
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Stand-in for ccache, which only runs the compiler.
+        launcher = os.path.join(folder, 'ccache')
+        with open(launcher, 'w') as f:
+            f.write('#!/bin/sh\nexec "$@"\n')
+        os.chmod(launcher, 0o755)
+        path = os.path.join(folder, 'compile_commands.json')
+        with open(path, 'w') as f:
+            json.dump([{'directory': os.getcwd(), 'file': 'tests/data/user_defined_type.cpp',
+                        'arguments': [launcher, 'g++', '-Iinclude', '-std=c++17', '-c',
+                                      'tests/data/user_defined_type.cpp']}], f)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(['--compile-commands', path])
+        assert out.getvalue().endswith('<==\nPrint type FooBar&. .i = 1, .i = 2.\n')
+
+
+def test_dedup():
+    with source_folder() as folder:
+        with open(os.path.join(folder, 'shared.hpp'), 'w') as f:
+            f.write('#include <ctp/ctp.hpp>\nconstexpr auto shared = ctp::print("shared", 1);\n')
+        entries = []
+        for name in ['a', 'b', 'c']:
+            source = os.path.join(folder, name + '.cpp')
+            with open(source, 'w') as f:
+                f.write('#include "shared.hpp"\nconstexpr auto i = ctp::print("in {0}");\n'
+                        'constexpr auto j = ctp::print("in {0}");\n'.format(name))
+            entries.append({'directory': os.getcwd(), 'file': source,
+                            'arguments': ['g++', '-Iinclude', '-std=c++17', source]})
+        path = os.path.join(folder, 'compile_commands.json')
+        with open(path, 'w') as f:
+            json.dump(entries, f)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(['--compile-commands', path, '--dedup'])
+        # The column of the call depends on the GCC version.
+        assert re.sub(r'(shared\.hpp:2):\d+', r'\1', out.getvalue()) == (
+            '==> {0}/a.cpp <==\nshared 1\nin a\nin a\n'
+            '==> {0}/b.cpp <==\nin b\nin b\n'
+            '==> {0}/c.cpp <==\nin c\nin c\n'
+            '==> Printed by several translation units <==\n'
+            '3x {0}/shared.hpp:2: shared 1\n'
+            '   {0}/a.cpp, {0}/b.cpp, {0}/c.cpp\n').format(os.path.abspath(folder))
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(['--compile-commands', path, '--dedup', '--format', 'jsonl'])
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [record['message'] for record in records] == [
+            'shared 1\n', 'in a\n', 'in a\n', 'in b\n', 'in b\n', 'in c\n', 'in c\n', 'shared 1\n']
+        assert records[-1]['count'] == 3
+
+    with pytest.raises(SystemExit):
+        main(['--dedup', '--', 'g++'])
+
+
+class ScriptedWatcher:
+    """
+    Writes the given files instead of waiting for changes and stops watching after the last one.
+    """
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.files = set()
+        self.armed = []
+        self.closed = False
+
+    def watch(self, files):
+        self.files = set(files)
+        self.armed.append(self.files)
+
+    def wait(self):
+        if not self.changes:
+            raise KeyboardInterrupt
+        path, content = self.changes.pop(0)
+        with open(path, 'w') as f:
+            f.write(content)
+        return {path}
+
+    def close(self):
+        self.closed = True
+
+
+def test_watch():
+    assert parse_depfile('a.o: a.cpp /usr/include/x.h \\\n b\\ c.hpp d$$.hpp\nb\\ c.hpp:\n', '/src') == {
+        '/src/a.cpp', '/usr/include/x.h', '/src/b c.hpp', '/src/d$.hpp'}
+
+    with source_folder() as folder:
+        header = os.path.join(folder, 'a.hpp')
+        with open(header, 'w') as f:
+            f.write('#define A 1\n')
+        source = os.path.join(folder, 'a.cpp')
+        with open(source, 'w') as f:
+            f.write('#include <ctp/ctp.hpp>\n#include "a.hpp"\nconstexpr auto i = ctp::print("A is", A);\n')
+        other = os.path.join(folder, 'other.cpp')
+        with open(other, 'w') as f:
+            f.write('#include <ctp/ctp.hpp>\nconstexpr auto i = ctp::print("other");\n')
+
+        polling = PollingWatcher(interval=0.01)
+        polling.watch([header])
+        os.utime(header, ns=(0, 0))
+        assert polling.wait() == {header}
+
+        command = ['g++', '-Iinclude', '-fsyntax-only', '-std=c++17']
+        # Watchers report absolute paths.
+        changed = os.path.abspath(header)
+        watcher = ScriptedWatcher([(changed, '#define A 2\n'), (changed, '#define A 2 // unchanged\n')])
+        out = io.StringIO()
+        err = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            watch(parse_args(['--watch', '--no-color', '--', *command, source]), watcher, folder)
+        expected = ('==> {0} <==\nA is 1\n'
+                    'Changed: {1}\n==> {0} <==\n--- previous run\n+++ this run\n@@ -1 +1 @@\n-A is 1\n+A is 2\n'
+                    'Changed: {1}\n==> {0} <==\nOutput unchanged.\n')
+        assert out.getvalue() == expected.format(os.path.abspath(source), header)
+        assert watcher.files >= {os.path.abspath(source), changed, os.path.abspath('include/ctp/ctp.hpp')}
+        assert watcher.closed
+        # Armed before each compile, before the first one only the source file is known.
+        assert len(watcher.armed) == 6
+        assert watcher.armed[0] == {os.path.abspath(source)}
+        assert all(changed in files for files in watcher.armed[1:])
+
+        # Only translation units depending on the changed file are compiled again.
+        path = os.path.join(folder, 'compile_commands.json')
+        with open(path, 'w') as f:
+            json.dump([{'directory': os.getcwd(), 'file': file, 'arguments': command + [file]}
+                       for file in [source, other]], f)
+        out = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(io.StringIO()):
+            watch(parse_args(['--watch', '--no-color', '--compile-commands', path]),
+                  ScriptedWatcher([(changed, '#define A 3\n')]), folder)
+        expected = ('==> {0} <==\nA is 2\n==> {1} <==\nother\n'
+                    'Changed: {2}\n==> {0} <==\n--- previous run\n+++ this run\n@@ -1 +1 @@\n-A is 2\n+A is 3\n')
+        assert out.getvalue() == expected.format(os.path.abspath(source), os.path.abspath(other), header)
+
+    for args in [['--watch'], ['--watch', '--', 'make'], ['--watch', '--cache', '--', 'g++', 'a.cpp']]:
+        with pytest.raises(SystemExit):
+            main(args)
+
+
+def test_server():
+    def post(data, headers=()):
+        request = urllib.request.Request('http://{}:{}/api/compiler/g122/compile'.format(*server.server_address[:2]),
+                                         json.dumps(data).encode('utf8'), {'Content-Type': 'application/json',
+                                                                           **dict(headers)})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    # The web playground replaces the include with the C++ header and passes its length and line as offset.
+    with open('include/ctp/ctp.hpp') as f:
+        header = f.read()
+    include_offset = [header.count('\n'), 1]
+    flags = '-std=c++17 -fpermissive -fsyntax-only'
+
+    pool = CompilerPool({}, 'g++', 2, 60)
+    server = create_server('127.0.0.1', 0, pool)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        status, result = post({'source': header + '\nconstexpr auto i = ctp::print("Hello", 1);\n',
+                               'options': {'userArguments': flags},
+                               'ctp': {'include_offset': include_offset, 'show_compiler_log': False}},
+                              {'Origin': 'https://viatorus.github.io'})
+        assert status == 200
+        assert result['code'] == 0
+        assert result['stderr']
+        assert result['ctp'] == [{'message': 'Hello 1\n', 'error_output': False, 'compiler_output': False}]
+
+        # Line numbers of the compiler log are fixed like for godbolt.org.
+        status, result = post({'source': header + '\nint i = x;\n', 'options': {'userArguments': flags},
+                               'ctp': {'include_offset': include_offset, 'show_compiler_log': True}})
+        assert status == 200
+        assert result['code'] != 0
+        assert any(printer['message'].startswith('<source>:2:9: error:') for printer in result['ctp'])
+
+        # Without ctp options, only the compiler log is returned like by godbolt.org.
+        status, result = post({'source': 'int main() { return x; }', 'options': {'userArguments': flags}})
+        assert status == 200
+        assert 'ctp' not in result
+        assert any(line['text'].startswith('<source>:1:21: error:') for line in result['stderr'])
+
+        # A newer request of the same session stops the running compiler of the previous one.
+        slow = 'constexpr int f() { int s = 0; for (int i = 0; i < 100000; ++i) for (int j = 0; j < 100000; ++j) ' \
+               's += i ^ j; return s; }\nconstexpr int x = f();\n'
+        superseded = {}
+        thread = threading.Thread(target=lambda: superseded.update(zip(['status', 'result'], post(
+            {'source': slow, 'options': {'userArguments': flags + ' -fconstexpr-ops-limit=1000000000000'},
+             'session': 'a'}))))
+        start = time.monotonic()
+        thread.start()
+        while 'a' not in pool._running:
+            time.sleep(0.01)
+        status, result = post({'source': 'int i;', 'options': {'userArguments': flags}, 'session': 'a'})
+        thread.join()
+        assert status == 200
+        assert result['code'] == 0
+        assert superseded['status'] == 409
+        assert time.monotonic() - start < 30
+        assert not pool._running and not pool._latest
+
+        malformed_ctp = [True, [1], {'include_offset': 1}, {'include_offset': [1, '2']}, {'include_offset': [1]},
+                         {'include_offset': [True, 0]}, {'show_compiler_log': 'yes'}]
+        malformed = [{'options': {}}, [], {'source': 1}, {'source': '', 'options': []}, {'source': '', 'session': 1}]
+        for body in malformed + [{'source': '', 'ctp': ctp} for ctp in malformed_ctp]:
+            status, result = post(body)
+            assert status == 400
+            assert result['error'].startswith('Invalid request: ')
+        for flag in ['-wrapper /bin/sh', '-fplugin=x.so', '-B/tmp', '@args', '-Wl,-x', '-Wp,-x', '-I/']:
+            assert post({'source': 'int i;', 'options': {'userArguments': flag}})[0] == 400
+        assert post({'source': 'int i;', 'options': {'userArguments': flags}}, {'Origin': 'https://example.com'})[0] \
+            == 403
+    finally:
+        server.shutdown()
+        server.server_close()
+        pool.close()
+
+
 if __name__ == '__main__':
     pass
@@ -1,10 +1,18 @@
+import asyncio
+import json
 import math
+import pickle
+import random
+import re
 import subprocess
 import sys
 from itertools import zip_longest
 
 import pytest
-from compile_time_printer.ctp import CTP, TypePrettifier, CompilerStatement
+from compile_time_printer.ctp import CTP, TypePrettifier, CompilerStatement, Demultiplexer, \
+    Indicator, PrintStatement, ValueStack, is_source_snippet, run_many, to_json_value
+from compile_time_printer.json_diagnostics import INTEGER_WARNING, JsonCTP
+from tests.synthetic_log import generate_log
 
 cpp_file = """
 {}
@@ -22,8 +30,17 @@ static_assert(test());
 """
 
 
-def compile_file(input_file):
-    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only', '-xc++', '-']
+def gcc_major_version():
+    prog = subprocess.run(['g++', '-dumpversion'], stdout=subprocess.PIPE, check=True)
+    return int(prog.stdout.decode('utf8').split('.')[0])
+
+
+# -fdiagnostics-format=json is supported since GCC 9.
+requires_json_diagnostics = pytest.mark.skipif(gcc_major_version() < 9, reason='requires GCC 9 or newer')
+
+
+def compile_file(input_file, flags=()):
+    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only', '-xc++', '-', *flags]
     prog = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     prog.stdin.write(input_file.encode('utf8'))
     prog.stdin.close()
@@ -33,13 +50,13 @@ def compile_file(input_file):
     prog.stderr.close()
 
 
-def compile_print_call(args, format=False, func_scope='', global_scope='', pre_include=''):
+def compile_print_call(args, format=False, func_scope='', global_scope='', pre_include='', flags=()):
     if format:
         call = 'printf'
     else:
         call = 'print'
     args = [str(x) for x in args]
-    return compile_file(cpp_file.format(pre_include, global_scope, func_scope, call, ', '.join(args)))
+    return compile_file(cpp_file.format(pre_include, global_scope, func_scope, call, ', '.join(args)), flags)
 
 
 def assert_printers(log, expected, prettifier=None):
@@ -169,6 +186,22 @@ def test_type():
     assert_printers(log, [(False, sys.stdout, ['float, char'])])
 
 
+def test_type_prettifier():
+    type_prettifier = TypePrettifier(['b', 'ac'], [])
+    assert type_prettifier.prettify('abc') == ''
+    assert type_prettifier.prettify('abc') == ''
+
+    # One pass can't match text joined by a previous remove.
+    type_prettifier = TypePrettifier(['b', 'ac'], [], combine_removes=True)
+    assert type_prettifier.prettify('abc') == 'ac'
+
+    type_prettifier = TypePrettifier(['std::', '<char>'], ['(tu)ple'], combine_removes=True, cache_size=2)
+    assert type_prettifier.prettify('std::tuple<char>') == 'tu'
+    assert type_prettifier.prettify('std::tuple<int>') == 'tu<int>'
+    assert type_prettifier.prettify('std::array<char, 2>') == 'array<char, 2>'
+    assert type_prettifier.prettify('std::tuple<char>') == 'tu'
+
+
 def test_string():
     log = compile_print_call(['"hello"'])
     assert_printers(log, [(False, sys.stdout, ['hello'])])
@@ -176,6 +209,39 @@ def test_string():
     log = compile_print_call(['"how"', '"how"', '"are"', '"are"', '"you?"', '"you?"'])
     assert_printers(log, [(False, sys.stdout, ['how', 'how', 'are', 'are', 'you?', 'you?'])])
 
+    log = compile_print_call(['""'])
+    assert_printers(log, [(False, sys.stdout, [''])])
+
+    log = compile_print_call(['"h\u00e4ll\u00f6 \u20ac"'])
+    assert_printers(log, [(False, sys.stdout, ['h\u00e4ll\u00f6 \u20ac'])])
+
+    log = compile_print_call(['"a\\xff" "b"'])
+    assert_printers(log, [(False, sys.stdout, ['a\ufffdb'])])
+
+    log = compile_print_call(['s'], func_scope='std::string_view s{"\\0a", 2};')
+    assert_printers(log, [(False, sys.stdout, ['\0a'])])
+
+    # Packed values of protocol version 2 hold up to 16 characters.
+    strings = ['a' * 15, 'b' * 16, 'c' * 17, 'd' * 32, '\u20ac' * 11]
+    log = compile_print_call(['"{}"'.format(string) for string in strings])
+    assert_printers(log, [(False, sys.stdout, strings)])
+
+    log = compile_print_call(['"h\u00e4ll\u00f6 \u20ac"', '""', '"a\\xff" "b"'],
+                             pre_include='#define CTP_PROTOCOL_VERSION 1')
+    assert_printers(log, [(False, sys.stdout, ['h\u00e4ll\u00f6 \u20ac', '', 'a\ufffdb'])])
+
+
+def test_protocol_version():
+    log = compile_print_call([1], pre_include='#define CTP_PROTOCOL_VERSION 1')
+    assert_printers(log, [(False, sys.stdout, [1])])
+
+    log = list(compile_print_call([1], pre_include='#define CTP_PROTOCOL_VERSION 3'))
+    assert any('Only protocol version 1 and 2 are supported.' in line for line in log)
+
+    ctp = CTP(TypePrettifier([], []), False)
+    with pytest.raises(Exception, match='Incompatible CTP versions: C\\+\\+ v3 <-> Python v2'):
+        ctp.parse_error_log(iter(generate_log([], protocol_version=3)))
+
 
 def test_array():
     log = compile_print_call(['x'], func_scope='int x[] = {1, 2, 3};')
@@ -223,6 +289,21 @@ def test_view():
     with pytest.raises(Exception):
         assert_printers(log, [])
 
+    # Integers are packed since protocol version 2, runs of equal integers are sent as count and integer.
+    values = 'INT64_MIN, INT64_MAX, -1, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 7, 7, 7'
+    log = compile_print_call(['ctp::view(x)'], func_scope='int64_t x[] = {{{}}};'.format(values))
+    assert_printers(log, [(False, sys.stdout, [[-2 ** 63, 2 ** 63 - 1, -1] + [0] * 5 + list(range(1, 17)) + [7] * 3])])
+
+    values = 'UINT64_MAX, 0, 5, 5, 5, 5'
+    log = compile_print_call(['x'], func_scope='std::array<uint64_t, 6> x{{{}}};'.format(values))
+    assert_printers(log, [(False, sys.stdout, [[2 ** 64 - 1, 0] + [5] * 4])])
+
+    for pre_include in ['', '#define CTP_PROTOCOL_VERSION 1']:
+        log = compile_print_call(['ctp::view(x)', 'y', 'z'], pre_include=pre_include,
+                                 func_scope='short x[300] = {-1, 1}; unsigned char y[] = {200, 200, 200, 200}; '
+                                            "std::array<char, 2> z{{'a', 'b'}};")
+        assert_printers(log, [(False, sys.stdout, [[-1, 1] + [0] * 298, [200] * 4, ['a', 'b']])])
+
     user_defined_container = """
     struct A {
         constexpr int* data() const {
@@ -274,6 +355,24 @@ def test_output_stream():
     assert_printers(log, [(True, sys.stderr, ['{}', 1])])
 
 
+def test_protocol_version_diagnostic():
+    log = list(compile_print_call([1], flags=['-fno-diagnostics-show-caret']))
+    i = next(i for i, line in enumerate(log) if 'unused variable' in line)
+    location = log[i][:log[i].index(' warning: ')]
+    expected = [(False, sys.stdout, [1])]
+
+    # Turned into an error or localized.
+    for diagnostic in [" error: unused variable 'version' [-Werror=unused-variable]\n",
+                       ' Fehler: Variable \xbbversion\xab wird nicht verwendet\n']:
+        assert_printers(log[:i] + [location + diagnostic] + log[i + 1:], expected)
+
+    # Missing, the following lines are parsed as usual.
+    assert_printers(log[:i] + log[i + 1:], expected)
+    ctp = CTP(TypePrettifier([], []), True)
+    ctp.parse_error_log(log[:i] + ['a.cpp:1:1:   unrelated\n', 'unrelated\n'])
+    assert ('unrelated\n', True) in [statement.serialize() for statement in ctp.printers]
+
+
 def test_user_defined_type():
     outer_scope = """
     struct A{{}};
@@ -300,5 +399,381 @@ def test_user_defined_type():
     assert_printers(log, [(False, sys.stdout, [])])
 
 
+def test_lazy_message():
+    statement = PrintStatement(0.0, True, sys.stdout, ['{:>8}|{[0]}\n', 'a=[1, 2]', ('a=[1, 2]',)])
+    other = PrintStatement(0.0, False, sys.stdout, ['a=[1, 2]', ['a=[1, 2]']])
+    assert statement._message is None and other._message is None
+
+    assert statement.serialize() == ('a=[1, 2]|a=[1, 2]\n', False)
+    assert other.serialize() == ("a=[1, 2] ['a=[1, 2]']\n", False)
+    assert to_json_value(other._args) == ['a=[1, 2]', ['a=[1, 2]']]
+
+
+def test_user_defined_type_is_str():
+    outer_scope = """
+    struct A{};
+    template<>
+    struct ctp::formatter<A> {
+        static constexpr auto format(const A& a) {
+            return std::tuple("{}={}", 1, 2);
+        }
+    };
+    """
+    ctp = CTP(TypePrettifier([], []), False)
+    ctp.parse_error_log(compile_print_call(['A{}, std::tuple(A{})'], global_scope=outer_scope))
+    value, (nested,) = ctp.printers[0]._args
+    assert isinstance(value, str) and value == nested == '1=2'
+    assert len(value) == 3 and value[0] == '1' and value + '!' == '1=2!' and '{[0]}'.format(value) == '1'
+    assert json.loads(json.dumps(ctp.printers[0].record()))['args'] == ['1=2', ['1=2']]
+
+
+def test_stream():
+    lines = list(compile_print_call([2], func_scope='ctp::print(1);'))
+    consumed = []
+
+    def log():
+        for line in lines:
+            consumed.append(line)
+            yield line
+
+    ctp = CTP(TypePrettifier([], []), False)
+    printers = ctp.stream_error_log(log())
+    # First statement is available before the whole log has been read.
+    assert next(printers)._args == [1]
+    assert len(consumed) < len(lines)
+    assert [p._args for p in printers] == [[2]]
+    assert len(consumed) == len(lines)
+
+
+def test_compiler_log_window():
+    noise = ['tests/data/noise.cpp:{}:1: warning: unused variable [-Wunused-variable]\n'.format(i) for i in range(1000)]
+
+    ctp = CTP(TypePrettifier([], []), True, compiler_log_window=100)
+    statements = []
+    for line in noise:
+        statements += ctp.feed(line)
+        assert len(ctp._compiler_log) <= 100
+    # Lines leaving the window are printed before the log ends.
+    assert len(statements) == 900
+    assert all(isinstance(s, CompilerStatement) for s in statements)
+    assert [s._message for s in statements + ctp.finish(report_missing_output=False)] == noise
+
+    ctp = CTP(TypePrettifier([], []), False, compiler_log_window=100)
+    for line in noise:
+        assert ctp.feed(line) == []
+    assert len(ctp._compiler_log) == 0
+
+
+def test_async():
+    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only']
+    files = ['user_defined_type.cpp', 'value_stack.cpp', 'fibonacci_with_noise.cpp', 'no_print_statement.cpp']
+    results = asyncio.run(run_many([command + ['tests/data/' + file] for file in files],
+                                   lambda: CTP(TypePrettifier([], []), False), jobs=2))
+    assert [[s.serialize() for s in statements] for statements, _, _ in results] == [
+        [('Print type FooBar&. .i = 1, .i = 2.\n', False)],
+        [('[0, 0, 0]\n', False), ('push 2\n', False), ('push 5\n', False), ('push 7\n', False),
+         ('[2, 5, 7]\n', False), ('Stack overflow!\n', True)],
+        [('1 + ', False)] * 8 + [('0 = 8\n', False)],
+        [],
+    ]
+    assert [(return_code, error) for _, return_code, error in results] == [(0, None)] * 4
+
+    async def parse_without_permissive():
+        return_code = [0]
+        ctp = CTP(TypePrettifier([], []), False)
+        with pytest.raises(Exception, match='Did you forget -fpermissive?'):
+            async for _ in ctp.arun(command[:-2] + ['-fsyntax-only', 'tests/data/fibonacci.cpp'], return_code):
+                pass
+        return return_code[0]
+
+    assert asyncio.run(parse_without_permissive()) != 0
+
+
+def compile_data_file(file, flags=()):
+    command = ['g++', '-Iinclude', '-std=c++17', '-fpermissive', '-fsyntax-only', 'tests/data/' + file, *flags]
+    prog = subprocess.run(command, stderr=subprocess.PIPE)
+    return prog.stderr.decode('utf8').splitlines(keepends=True)
+
+
+def split_diagnostics(log):
+    chunks = []
+    for line in log:
+        if not chunks or line.startswith(('tests/data/', 'In file included')):
+            chunks.append([])
+        chunks[-1].append(line)
+    return chunks
+
+
+def test_demultiplex():
+    files = ['user_defined_type.cpp', 'value_stack.cpp', 'fibonacci_with_noise.cpp']
+    logs = [compile_data_file(file) for file in files]
+    expected = []
+    for log in logs:
+        ctp = CTP(TypePrettifier([], []), False)
+        ctp.parse_error_log(iter(log))
+        expected.append([printer.serialize() for printer in ctp.printers])
+
+    # Interleave the logs like parallel compilers writing to the same stream.
+    interleaved = [line for chunks in zip_longest(*[split_diagnostics(log) for log in logs], fillvalue=[])
+                   for chunk in chunks for line in chunk]
+
+    ctp = CTP(TypePrettifier([], []), False)
+    with pytest.raises(Exception):
+        ctp.parse_error_log(iter(interleaved))
+
+    demultiplexer = Demultiplexer(lambda: CTP(TypePrettifier([], []), False))
+    demultiplexer.parse_error_log(iter(interleaved))
+    printers = [printer.serialize() for printer in demultiplexer.printers]
+    assert len(printers) == sum(len(e) for e in expected)
+    for e in expected:
+        assert [printer for printer in printers if printer in e] == e
+
+    demultiplexer = Demultiplexer(lambda: CTP(TypePrettifier([], []), False))
+    demultiplexer.parse_error_log(iter(['unrelated\n']))
+    assert [printer.serialize() for printer in demultiplexer.printers] == [('No CTP output found.\n', True)]
+
+
+def reference_parse_values(values, type_prettifier):
+    """
+    Former if/elif implementation of the value decoder to compare with.
+    """
+    stack = [[]]
+    for type_of_value, number, indicator in values:
+        indicator = Indicator(indicator)
+        if indicator == Indicator.NaNFloat:
+            stack[-1].append(math.nan)
+        elif indicator == Indicator.PositiveInfinityFloat:
+            stack[-1].append(math.inf)
+        elif indicator == Indicator.NegativeInfinityFloat:
+            stack[-1].append(-math.inf)
+        elif indicator == Indicator.PositiveFloat:
+            stack.append(number)
+        elif indicator == Indicator.NegativeFloat:
+            stack.append(-number)
+        elif indicator == Indicator.FractionFloat:
+            num = stack.pop()
+            factor = 1 if num >= 0 else -1
+            num += factor * float(number) / math.pow(10, 18)
+            stack[-1].append(num)
+        elif indicator == Indicator.PositiveInteger:
+            if type_of_value == 'char':
+                stack[-1].append(chr(number))
+            elif type_of_value == 'bool':
+                stack[-1].append(bool(number))
+            else:
+                stack[-1].append(number)
+        elif indicator == Indicator.NegativeInteger:
+            stack[-1].append(-number)
+        elif indicator == Indicator.Type:
+            stack[-1].append(type_prettifier.prettify(type_of_value))
+        elif indicator in [Indicator.ArrayBegin, Indicator.StringBegin, indicator.TupleBegin]:
+            stack.append([])
+        elif indicator == Indicator.ArrayEnd:
+            array = stack.pop()
+            stack[-1].append(array)
+        elif indicator == Indicator.StringEnd:
+            array = stack.pop()
+            stack[-1].append(''.join(array))
+        elif indicator == Indicator.TupleEnd:
+            array = stack.pop()
+            stack[-1].append(tuple(array))
+        elif indicator == Indicator.CustomFormatBegin:
+            pass
+        elif indicator == Indicator.CustomFormatEnd:
+            array = [*stack[-1].pop()]
+            stack[-1].append(array[0].format(*array[1:]))
+    assert len(stack) == 1
+    return stack.pop()
+
+
+def random_value(rng, depth=0):
+    """
+    Generates the (type, number, indicator) sequence of a random value.
+    """
+    kinds = ['int', 'bool', 'char', 'float', 'special_float', 'type', 'string']
+    if depth < 3:
+        kinds += ['array', 'tuple', 'custom_format']
+    kind = rng.choice(kinds)
+    if kind == 'int':
+        number = rng.randrange(2 ** 64)
+        return [('long int', number, rng.choice([Indicator.PositiveInteger, Indicator.NegativeInteger]))]
+    if kind == 'bool':
+        return [('bool', rng.randrange(2), Indicator.PositiveInteger)]
+    if kind == 'char':
+        return [('char', rng.randrange(32, 127), Indicator.PositiveInteger)]
+    if kind == 'float':
+        return [('double', rng.randrange(10 ** 6), rng.choice([Indicator.PositiveFloat, Indicator.NegativeFloat])),
+                ('double', rng.randrange(10 ** 18), Indicator.FractionFloat)]
+    if kind == 'special_float':
+        return [('float', 1, rng.choice([Indicator.NaNFloat, Indicator.PositiveInfinityFloat,
+                                         Indicator.NegativeInfinityFloat]))]
+    if kind == 'type':
+        return [(rng.choice(['int', 'std::tuple<char>', 'const A&']), 1, Indicator.Type)]
+    if kind == 'string':
+        return ([('std::string_view', 1, Indicator.StringBegin)] +
+                [('char', rng.randrange(32, 127), Indicator.PositiveInteger) for _ in range(rng.randrange(10))] +
+                [('std::string_view', 1, Indicator.StringEnd)])
+    if kind == 'custom_format':
+        values = [('A', 1, Indicator.CustomFormatBegin), ('std::tuple', 1, Indicator.TupleBegin),
+                  ('std::string_view', 1, Indicator.StringBegin)]
+        values += [('char', ord(c), Indicator.PositiveInteger) for c in '{} - {}']
+        values += [('std::string_view', 1, Indicator.StringEnd)]
+        values += random_value(rng, depth + 1) + random_value(rng, depth + 1)
+        return values + [('std::tuple', 1, Indicator.TupleEnd), ('A', 1, Indicator.CustomFormatEnd)]
+    if kind == 'array':
+        begin, end = Indicator.ArrayBegin, Indicator.ArrayEnd
+    else:
+        begin, end = Indicator.TupleBegin, Indicator.TupleEnd
+    values = [(kind, 1, begin)]
+    for _ in range(rng.randrange(5)):
+        values += random_value(rng, depth + 1)
+    return values + [(kind, 1, end)]
+
+
+def test_value_decoder_equivalence():
+    rng = random.Random(42)
+    type_prettifier = TypePrettifier(['std::'], [])
+    for _ in range(500):
+        values = [v for _ in range(rng.randrange(1, 5)) for v in random_value(rng)]
+        stack = ValueStack()
+        for type_of_value, number, indicator in values:
+            stack.decode(type_of_value, number, int(indicator), type_prettifier)
+        assert repr(stack.arguments()) == repr(reference_parse_values(values, type_prettifier))
+
+
+def test_synthetic_log():
+    statements = [[1, -2, True, 'h\xe9llo', (1, (2.5, 'x')), [1, 2, 3]], [-1.25, math.inf, -math.inf, ''], [[]]]
+    ctp = CTP(TypePrettifier([], []), True)
+    ctp.parse_error_log(iter(generate_log(statements, noise_per_statement=2)))
+    printers = [printer for printer in ctp.printers if not isinstance(printer, CompilerStatement)]
+    assert [printer._args for printer in printers] == statements
+
+    statements = [['a' * 15, 'b' * 16, 'c' * 17, 'h\xe9llo \u20ac', ''],
+                  [[-2 ** 63, 2 ** 63 - 1, 0, 0, 0, 0, 1, 1, 1], list(range(-100, 100)), [True, False]]]
+    for protocol_version in [1, 2]:
+        ctp = CTP(TypePrettifier([], []), False)
+        ctp.parse_error_log(iter(generate_log(statements, protocol_version=protocol_version)))
+        assert [printer._args for printer in ctp.printers] == statements
+
+
+def test_arrival_time():
+    arrival_time = [10.0]
+    ctp = CTP(TypePrettifier([], []), False, clock=lambda: arrival_time[0])
+    printers = []
+    for i in range(3):
+        arrival_time[0] += i
+        for line in generate_log([[i]]):
+            printers += ctp.feed(line)
+    time_points = [printer._time_point for printer in printers + ctp.finish()]
+    assert time_points == [0, 1, 3]
+
+    # Parsers created later, e.g. by the demultiplexer, share the start time.
+    ctp = CTP(TypePrettifier([], []), False, clock=lambda: arrival_time[0], start_time=10.0)
+    ctp.parse_error_log(iter(generate_log([[0]])))
+    assert [printer._time_point for printer in ctp.printers] == [3]
+
+
+def test_compact_statements():
+    ctp = CTP(TypePrettifier([], []), False)
+    ctp.parse_error_log(compile_print_call(['ctp::stderr', 'ctp::type<std::tuple<char>>{}',
+                                            'ctp::type<std::tuple<char>>{}']))
+    statement = ctp.printers[0]
+    assert statement._args == ['std::tuple<char>', 'std::tuple<char>']
+    assert statement._args[0] is statement._args[1]
+    # Location of the call of ctp::print.
+    assert re.fullmatch(r'<stdin>:\d+:\d+', statement._location)
+
+    # Statements have no __dict__ and are passed between processes with their output stream.
+    assert not hasattr(statement, '__dict__')
+    assert not hasattr(CompilerStatement(''), '__dict__')
+    copy = pickle.loads(pickle.dumps(statement))
+    assert copy.serialize() == statement.serialize() == ('std::tuple<char> std::tuple<char>\n', True)
+    assert copy._time_point == statement._time_point and copy._location == statement._location
+    assert PrintStatement.deserialize('a\n', False, 1.5).record()['time_point'] == 1.5
+
+
+def test_to_json_value():
+    assert to_json_value([1, (2.5, math.nan), ['a', [math.inf, -math.inf]], True]) == [
+        1, [2.5, 'nan'], ['a', ['inf', '-inf']], True]
+
+
+def test_value_decoder_errors():
+    stack = ValueStack()
+    with pytest.raises(Exception, match='Unexpected indicator: 200'):
+        stack.decode('int', 1, 200, TypePrettifier([], []))
+
+    stack.decode('int', 1, int(Indicator.ArrayBegin), TypePrettifier([], []))
+    with pytest.raises(Exception, match='Incomplete print statement'):
+        stack.arguments()
+
+
+def parse_json_diagnostics(log, print_compiler_log=False):
+    ctp = JsonCTP(TypePrettifier([], []), print_compiler_log)
+    ctp.parse_error_log(log)
+    return [printer.serialize() for printer in ctp.printers]
+
+
+@requires_json_diagnostics
+def test_json_diagnostics():
+    flags = ['-fdiagnostics-format=json']
+    args = ['1', '-2.5', '"h\\xc3\\xa9llo"', 'std::array<int, 3>{{1, 1, 2}}', 'std::tuple{1, "x"}', 'true']
+    log = list(compile_print_call(args, global_scope='constexpr int f() { int unused = 0; return 0; }',
+                                  flags=flags + ['-Wall']))
+    assert len(log) == 1
+    statements = parse_json_diagnostics(log, True)
+    # Diagnostics unrelated to CTP are printed without source snippets.
+    assert re.fullmatch(r'<stdin>:5:25: warning: unused variable .unused. \[-Wunused-variable]\n', statements[0][0])
+    # Bools are printed as integers, their type is unknown.
+    assert statements[-2:] == [(INTEGER_WARNING, True), ("1 -2.5 h\xe9llo [1, 1, 2] (1, 'x') 1\n", False)]
+
+    log = compile_print_call(['"{} {}"', 1, 2], format=True, func_scope='ctp::print(ctp::stderr, 3);', flags=flags)
+    assert parse_json_diagnostics(log) == [(INTEGER_WARNING, True), ('3\n', True), ('1 2', False)]
+    assert parse_json_diagnostics(compile_print_call(['"text"', 2.5], flags=flags)) == [('text 2.5\n', False)]
+
+    log = compile_print_call(['ctp::type<int>{}'], flags=flags)
+    with pytest.raises(Exception, match='Types cannot be printed with JSON diagnostics'):
+        parse_json_diagnostics(log)
+
+    assert parse_json_diagnostics(compile_print_call([1], pre_include='#define CTP_DEAD_QUIET', flags=flags)) == [
+        ('No CTP output found.\n', True)]
+
+    # Diagnostics are decoded as soon as they are complete, even if GCC pretty prints them.
+    log = compile_data_file('fibonacci.cpp', flags)
+    diagnostics = json.loads(log[0])
+    pretty_log = ['make: Entering directory\n'] + json.dumps(diagnostics, indent=2).splitlines(keepends=True)
+    ctp = JsonCTP(TypePrettifier([], []), True)
+    statements = [s.serialize() for line in pretty_log for s in ctp.feed(line)]
+    assert statements == [('make: Entering directory\n', True), (INTEGER_WARNING, True)] + [('1 + ', False)] * 8 + [
+        ('0 = 8\n', False)]
+    with pytest.raises(Exception, match='Incomplete JSON diagnostics'):
+        JsonCTP(TypePrettifier([], []), False).parse_error_log(iter(pretty_log[:-2]))
+
+    # SARIF logs of newer GCC versions are converted to the same diagnostics.
+    results = [{'ruleId': d.get('option'), 'level': d['kind'], 'message': {'text': d['message']},
+                'locations': [{'physicalLocation': {'artifactLocation': {'uri': d['locations'][0]['caret']['file']},
+                                                    'region': {'startLine': d['locations'][0]['caret']['line']}}}]}
+               for d in diagnostics]
+    sarif_log = [json.dumps({'version': '2.1.0', 'runs': [{'results': results}]}) + '\n']
+    assert parse_json_diagnostics(sarif_log) == [(INTEGER_WARNING, True)] + [('1 + ', False)] * 8 + [('0 = 8\n', False)]
+
+    log = compile_data_file('fibonacci.cpp', ['-fdiagnostics-format=json', '-fno-permissive'])
+    with pytest.raises(Exception, match='Did you forget -fpermissive?'):
+        parse_json_diagnostics(log)
+
+
+def test_reduced_diagnostics():
+    def parse(log):
+        ctp = CTP(TypePrettifier([], []), True)
+        ctp.parse_error_log(iter(log))
+        return [printer.serialize() for printer in ctp.printers]
+
+    for file in ['fibonacci_with_noise.cpp', 'type_stack.cpp', 'workarounds.cpp', 'user_defined_type.cpp']:
+        statements = parse(compile_data_file(file))
+        # Only the source snippets of the compiler log are missing.
+        assert parse(compile_data_file(file, ['-fno-diagnostics-show-caret', '-fno-diagnostics-color'])) == [
+            (message, is_stderr) for message, is_stderr in statements if not (is_stderr and is_source_snippet(message))]
+        assert parse(compile_data_file(file, ['-fno-diagnostics-show-line-numbers'])) == statements
+
+
 if __name__ == '__main__':
     pass
@@ -1,25 +1,34 @@
 /* global loadPyodide */
 import CTP_SOURCE from 'CTP/include/ctp/ctp.hpp';
 import CTP_PY_SOURCE from 'CTP/src/compile_time_printer/ctp.py';
-import CTP_WRAPPER_PY_SOURCE from './ctp_wrapper.py';
+import CTP_WRAPPER_PY_SOURCE from 'CTP/src/compile_time_printer/ctp_wrapper.py';
+
+// A local compile-time-printer-server compiles and parses instead, e.g. ?backend=http://127.0.0.1:10240
+const BACKEND = new URLSearchParams(window.location.search).get('backend');
+const SESSION = Math.random().toString(36).slice(2);
 
 // Use pyodide to run python code in js.
 let parse = null;
-const load_python = loadPyodide().then((pyodide) => {
+const load_python = BACKEND ? Promise.resolve() : loadPyodide().then((pyodide) => {
   pyodide.globals.set('__name__', 'module'); // Just load library files, don't execute main.
   pyodide.runPython(CTP_PY_SOURCE);
   pyodide.runPython(CTP_WRAPPER_PY_SOURCE);
   parse = pyodide.globals.get('parse');
 });
 
-function compile (compiler, compiler_flags, code) {
+function compile (compiler, compiler_flags, code, ctp) {
   const body = {
     source: code,
     options: {
       userArguments: compiler_flags + ' -fno-diagnostics-color -fsyntax-only'
     }
   };
-  return fetch(`https://godbolt.org/api/compiler/${compiler}/compile`, {
+  if (BACKEND) {
+    // The server parses the log as well and cancels the previous request of this session.
+    body.session = SESSION;
+    body.ctp = ctp;
+  }
+  return fetch(`${BACKEND || 'https://godbolt.org'}/api/compiler/${compiler}/compile`, {
     headers: {
       accept: 'application/json',
       'content-type': 'application/json'
@@ -28,7 +37,7 @@ function compile (compiler, compiler_flags, code) {
     method: 'POST'
   })
     .then(e => e.json())
-    .then(e => [e.code === 0, e.stderr.map(x => x.text)]);
+    .then(e => [e.code === 0, e.stderr.map(x => x.text), e.ctp]);
 }
 
 const CTP_INCLUDE = /#\s*include\s*<ctp\/ctp\.hpp>/;
@@ -56,21 +65,26 @@ function include_ctp_header (code) {
 
 export function compile_and_parse (compiler, compiler_flags, show_compiler_log, code) {
   let timeout, include_offset;
+  let cancelled = false;
   [include_offset, code] = include_ctp_header(code);
 
   const promise = new Promise(function (resolve, reject) {
     timeout = setTimeout(function () {
-      compile(compiler, compiler_flags, code)
-        .then(([succeeded, log]) =>
-          load_python
+      compile(compiler, compiler_flags, code, { include_offset, show_compiler_log })
+        .then(([succeeded, log, printers]) => printers
+          ? [succeeded, printers.map(printer => new Map(Object.entries(printer)))]
+          : load_python
             .then(() => [succeeded, parse(include_offset, log, show_compiler_log).toJs()])
         )
-        .then(resolve).catch(reject);
-    }, 500);
+        // Results of superseded requests, e.g. rejected by the server, are dropped.
+        .then(result => cancelled || resolve(result))
+        .catch(error => cancelled || reject(error));
+    }, BACKEND ? 100 : 500);
   });
   return {
     promise,
     cancel: function () {
+      cancelled = true;
       clearTimeout(timeout);
     }
   };